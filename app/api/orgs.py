@@ -1,24 +1,72 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlmodel import  Session, select
+from datetime import datetime
+from fastapi import APIRouter, Depends, HTTPException, Request
+from pydantic import EmailStr, TypeAdapter, ValidationError
+from typing import Optional
+
+from sqlalchemy import insert, literal
+from sqlmodel import select, update
+from sqlmodel.ext.asyncio.session import AsyncSession
 from app.models.invites import Invite
 from app.models.organisations import Organisation, UserOrganisation
+from app.models.stats import OrgTaskStats
 from app.models.user import User
-from app.db.session import get_session
-from app.auth.dependencies import get_current_user
-from app.schemas.user import OrganisationCreate, OrganisationRead, InviteUserRequest, PromoteUserRequest, OrganisationWithCreator
+from app.db.session import get_async_session
+from app.db.bulk import chunked, insert_ignore
+from app.db.changes import next_change_seq, stamp_change_seq
+from app.db.versions import bump_org_versions
+from app.auth.dependencies import get_current_principal, get_current_user
+from app.auth.permissions import ADMIN_ROLES, get_org_role, get_role, invalidate_membership
+from app.auth.principals import Principal, invalidate_user, issue_token, load_principal
+from app.auth.rate_limit import by_user, rate_limit
+from app.schemas.user import OrganisationCreate, OrganisationRead, InviteUserRequest, BulkEmailRequest, EmailItemResult, EmailBulkResult, PromoteUserRequest, OrganisationWithCreator, OrgTaskStatsRead
+from app.utils.events import broker
+from app.utils.http_cache import cached_json_response, make_etag
+from app.utils.outbox import enqueue, outbox_worker
 
 router = APIRouter(prefix="/organisations", tags=["organisations"])
+
+owned_adapter = TypeAdapter(list[OrganisationRead])
+belong_to_adapter = TypeAdapter(list[OrganisationWithCreator])
+email_adapter = TypeAdapter(EmailStr)
+
+
+def normalize_email(email: str) -> Optional[str]:
+    try:
+        return email_adapter.validate_python(email)
+    except ValidationError:
+        return None
+
+
+def email_results(raw: list[str], emails: list[Optional[str]], outcome: dict) -> EmailBulkResult:
+    return EmailBulkResult(results=[
+        EmailItemResult(index=index, email=email, status=outcome[email][0], id=outcome[email][1])
+        if email else EmailItemResult(index=index, email=original, status="invalid")
+        for index, (original, email) in enumerate(zip(raw, emails))
+    ])
+
+
+async def membership_etag(session: AsyncSession, user_id: int, scope: str) -> str:
+    #the user's memberships and their orgs' versions decide what the org lists contain
+    stmt = (
+        select(UserOrganisation.organisation_id, UserOrganisation.role, Organisation.version)
+        .join(Organisation, Organisation.id == UserOrganisation.organisation_id)
+        .where(UserOrganisation.user_id == user_id)
+        .order_by(UserOrganisation.organisation_id)
+    )
+    memberships = tuple(tuple(row) for row in (await session.exec(stmt)).all())
+    return make_etag(scope, user_id, memberships)
+
 @router.post("/Create", response_model=OrganisationRead)
-def create_organisation(
+async def create_organisation(
         org_data: OrganisationCreate,
-        session: Session = Depends(get_session),
+        session: AsyncSession = Depends(get_async_session),
         current_user: User = Depends(get_current_user)
 ):
     #Create a new org
     org = Organisation(name=org_data.name, creator_id=current_user.id)
     session.add(org)
-    session.commit()
-    session.refresh(org)
+    await session.commit()
+    await session.refresh(org)
 
     #link to a user
     link = UserOrganisation(user_id=current_user.id, organisation_id=org.id, role="owner")
@@ -27,109 +75,172 @@ def create_organisation(
     #set as active org
     current_user.active_org_id = org.id
 
-    session.commit()
+    await session.commit()
+    await invalidate_membership(current_user.id, org.id)
+    await invalidate_user(current_user.id)
     return org
 
 @router.get("/Owned", response_model=list[OrganisationRead])
-def get_owned_organisations(
-    session: Session = Depends(get_session),
-    current_user: User = Depends(get_current_user),
+async def get_owned_organisations(
+    request: Request,
+    session: AsyncSession = Depends(get_async_session),
+    current_user: Principal = Depends(get_current_principal),
 ):
-    stmt = select(Organisation).join(UserOrganisation).where(
-        (UserOrganisation.user_id == current_user.id) &
-        (UserOrganisation.role == "owner")
-    )
-    orgs = session.exec(stmt).all()
-    return orgs
+    etag = await membership_etag(session, current_user.id, "orgs/owned")
+
+    async def build() -> bytes:
+        stmt = select(Organisation).join(UserOrganisation).where(
+            (UserOrganisation.user_id == current_user.id) &
+            (UserOrganisation.role == "owner")
+        )
+        orgs = (await session.exec(stmt)).all()
+        return owned_adapter.dump_json([OrganisationRead.model_validate(org) for org in orgs])
+
+    return await cached_json_response(request, etag, ("orgs/owned", current_user.id, etag), build)
 
 @router.get("/Belongto", response_model=list[OrganisationWithCreator])
-def get_belong_to_organisations(
-    session: Session = Depends(get_session),
-    current_user: User = Depends(get_current_user),
+async def get_belong_to_organisations(
+    request: Request,
+    session: AsyncSession = Depends(get_async_session),
+    current_user: Principal = Depends(get_current_principal),
 ):
-    stmt = select(Organisation).join(UserOrganisation).where(
-        (UserOrganisation.user_id == current_user.id) &
-        (UserOrganisation.role.in_(["member", "admin"]))
-    )
-    orgs = session.exec(stmt).all()
-    result = [
-        OrganisationWithCreator(
-            id=org.id,
-            name=org.name,
-            creator_name=org.creator.name if org.creator else "Unknown"
+    etag = await membership_etag(session, current_user.id, "orgs/belongto")
+
+    async def build() -> bytes:
+        #async sessions can't lazy load org.creator, so fetch the name in the same query
+        stmt = (
+            select(Organisation, User.name)
+            .join(UserOrganisation, UserOrganisation.organisation_id == Organisation.id)
+            .join(User, User.id == Organisation.creator_id, isouter=True)
+            .where(
+                (UserOrganisation.user_id == current_user.id) &
+                (UserOrganisation.role.in_(["member", "admin"]))
+            )
         )
-        for org in orgs
-    ]
-    return result
+        rows = (await session.exec(stmt)).all()
+        result = [
+            OrganisationWithCreator(
+                id=org.id,
+                name=org.name,
+                creator_name=creator_name or "Unknown"
+            )
+            for org, creator_name in rows
+        ]
+        return belong_to_adapter.dump_json(result)
+
+    return await cached_json_response(request, etag, ("orgs/belongto", current_user.id, etag), build)
+
+
+@router.get("/stats", response_model=OrgTaskStatsRead)
+async def get_organisation_stats(org_id: int, role: Optional[str] = Depends(get_org_role), session: AsyncSession = Depends(get_async_session)):
+    if not role:
+        raise HTTPException(status_code=403, detail="You don't belong to this organisation.")
 
+    #counters kept up by every task write, one primary key read whatever the org's size
+    stats = await session.get(OrgTaskStats, org_id)
+    total, completed = (stats.total, stats.completed) if stats else (0, 0)
+    return OrgTaskStatsRead(organisation_id=org_id, total=total, completed=completed, open=total - completed)
 
 @router.patch("/switch")
-def switch_active_organisation(org_id: int, session: Session = Depends(get_session), current_user: User = Depends(get_current_user)):
+async def switch_active_organisation(org_id: int, role: Optional[str] = Depends(get_org_role), session: AsyncSession = Depends(get_async_session), current_user: User = Depends(get_current_user)):
     #check if user is in org
-    stmt = select(UserOrganisation).where((UserOrganisation.user_id == current_user.id) & (UserOrganisation.organisation_id == org_id))
-
-    link = session.exec(stmt).first()
-
-    if not link:
+    if not role:
         raise HTTPException(status_code=404, detail="You don't belong to this organisation.")
 
     #now to switch
     current_user.active_org_id = org_id
     session.add(current_user)
-    session.commit()
-    session.refresh(current_user)
+    await session.commit()
+    await invalidate_user(current_user.id)
 
-    return{"message": f"Switched to org {org_id}"}
+    #hand back a token carrying the new org so the client's next reads stay query free
+    principal = await load_principal(session, current_user.id)
+    return{"message": f"Switched to org {org_id}", "access_token": issue_token(principal), "token_type": "bearer"}
 
 @router.post("/add")
-def add_user(org_id: int, add_data: InviteUserRequest, session: Session = Depends(get_session), current_user: User = Depends(get_current_user)):
+async def add_user(org_id: int, add_data: InviteUserRequest, role: Optional[str] = Depends(get_org_role), session: AsyncSession = Depends(get_async_session), current_user: Principal = Depends(get_current_principal)):
     #check if the user is in the org already
-    stmt = select(UserOrganisation).where((UserOrganisation.user_id == current_user.id) & (UserOrganisation.organisation_id == org_id)) & (User.active_org_id == org_id)
-    member = session.exec(stmt).first()
-    if not member:
+    if not role:
         raise HTTPException(status_code=403, detail="You don't belong to this organisation.")
 
     #Find the user you want to invite
     stmt = select(User).where(User.email == add_data.email)
-    wanted_user = session.exec(stmt).first()
+    wanted_user = (await session.exec(stmt)).first()
     if not wanted_user:
         raise HTTPException(status_code=404, detail="User not found.")
 
     #check if they are in the org already
-    stmt = select(UserOrganisation).where((UserOrganisation.user_id == wanted_user.id) & (UserOrganisation.organisation_id == org_id))
-    existing_user = session.exec(stmt).first()
-    if existing_user:
+    if await get_role(session, wanted_user.id, org_id):
         raise HTTPException(status_code=409, detail="User already in organisation.")
 
     #now link/add the user
-    link = UserOrganisation(user_id=wanted_user.id, organisation_id=org_id)
+    await bump_org_versions(session, [org_id])
+    link = UserOrganisation(user_id=wanted_user.id, organisation_id=org_id, change_seq=await next_change_seq(session))
     session.add(link)
-    session.commit()
+    await session.commit()
+    await invalidate_membership(wanted_user.id, org_id)
+    broker.publish(org_id, "membership-changed", {"user_id": wanted_user.id, "role": link.role})
+
+    return {"message": f"{wanted_user.email} added to the org{org_id}"}
 
-    return {"message", f"{wanted_user.email} added to the org{org_id}"}
 
+@router.post("/add-bulk", response_model=EmailBulkResult)
+async def add_users_bulk(
+    org_id: int,
+    data: BulkEmailRequest,
+    role: Optional[str] = Depends(get_org_role),
+    session: AsyncSession = Depends(get_async_session),
+    current_user: Principal = Depends(get_current_principal),
+):
+    if not role:
+        raise HTTPException(status_code=403, detail="You don't belong to this organisation.")
 
-@router.post("/invite")
-def create_invite(org_id: int,
+    emails = [normalize_email(email) for email in data.emails]
+
+    outcome = {}
+    added = []
+    for chunk in chunked(list(dict.fromkeys(email for email in emails if email))):
+        #links only for users that exist, existing members are skipped by the database
+        stmt = (
+            insert_ignore(session, UserOrganisation)
+            .from_select(
+                ["user_id", "organisation_id", "role", "change_seq"],
+                select(User.id, literal(org_id), literal("member"), literal(0)).where(User.email.in_(chunk)),
+            )
+            .returning(UserOrganisation.user_id)
+        )
+        linked = set((await session.execute(stmt)).scalars().all())
+        added.extend(linked)
+
+        users = (await session.exec(select(User.email, User.id).where(User.email.in_(chunk)))).all()
+        outcome.update((email, ("added" if user_id in linked else "already_member", user_id)) for email, user_id in users)
+        outcome.update((email, ("not_found", None)) for email in chunk if email not in outcome)
+
+    if added:
+        await bump_org_versions(session, [org_id])
+        #the links went in unstamped, the seq comes last
+        seq = await next_change_seq(session)
+        await stamp_change_seq(session, seq, UserOrganisation, UserOrganisation.user_id, added, UserOrganisation.organisation_id == org_id)
+    await session.commit()
+    for user_id in added:
+        await invalidate_membership(user_id, org_id)
+        broker.publish(org_id, "membership-changed", {"user_id": user_id, "role": "member"})
+    return email_results(data.emails, emails, outcome)
+
+
+@router.post("/invite", dependencies=[Depends(rate_limit("invite", "30/minute", key=by_user))])
+async def create_invite(org_id: int,
     invite_data: InviteUserRequest,
-    session: Session = Depends(get_session),
-    current_user: User = Depends(get_current_user)
+    role: Optional[str] = Depends(get_org_role),
+    session: AsyncSession = Depends(get_async_session),
+    current_user: Principal = Depends(get_current_principal)
 ):
     # Check if current user is in the org
-    stmt = select(UserOrganisation).where(
-        (UserOrganisation.user_id == current_user.id) &
-        (UserOrganisation.organisation_id == org_id)
-    )
-    if not session.exec(stmt).first():
+    if not role:
         raise HTTPException(status_code=403, detail="You're not in this organisation.")
 
     # check if current user is an owner or admin
-    stmt = select(UserOrganisation).where(
-        (UserOrganisation.user_id == current_user.id) &
-        (UserOrganisation.organisation_id == org_id)
-    )
-    current_link = session.exec(stmt).first()
-    if current_link.role not in ["admin", "owner"]:
+    if role not in ADMIN_ROLES:
         raise HTTPException(status_code=403, detail="You don't have permission to invite.")
 
     #Check if invite already exists and is pending
@@ -138,7 +249,7 @@ def create_invite(org_id: int,
         (Invite.organisation_id == org_id) &
         (Invite.accepted == False)
     )
-    if session.exec(stmt).first():
+    if (await session.exec(stmt)).first():
         raise HTTPException(status_code=409, detail="Invite already sent")
 
     #Create the invite
@@ -148,16 +259,80 @@ def create_invite(org_id: int,
         inviter_id=current_user.id
     )
     session.add(invite)
-    session.commit()
+    await session.flush()
+    #delivery happens in the outbox worker, the request only records that it's owed
+    enqueue(session, "invite.created", {
+        "invite_id": invite.id,
+        "email": invite.email,
+        "organisation_id": org_id,
+        "inviter_id": current_user.id,
+    })
+    await session.commit()
+    outbox_worker.notify()
 
     return {"message": f"Invite sent to {invite_data.email}"}
 
 
+@router.post("/invite-bulk", response_model=EmailBulkResult, dependencies=[Depends(rate_limit("invite_bulk", "5/minute", key=by_user))])
+async def create_invites_bulk(
+    org_id: int,
+    data: BulkEmailRequest,
+    role: Optional[str] = Depends(get_org_role),
+    session: AsyncSession = Depends(get_async_session),
+    current_user: Principal = Depends(get_current_principal),
+):
+    if not role:
+        raise HTTPException(status_code=403, detail="You're not in this organisation.")
+    if role not in ADMIN_ROLES:
+        raise HTTPException(status_code=403, detail="You don't have permission to invite.")
+
+    emails = [normalize_email(email) for email in data.emails]
+
+    now = datetime.utcnow()
+    outcome = {}
+    for chunk in chunked(list(dict.fromkeys(email for email in emails if email))):
+        #pending invites and current members for the whole chunk, a query each
+        stmt = select(Invite.email).where(
+            (Invite.organisation_id == org_id) &
+            (Invite.email.in_(chunk)) &
+            (Invite.accepted == False)
+        )
+        outcome.update((email, ("already_invited", None)) for email in (await session.exec(stmt)).all())
+        stmt = (
+            select(User.email, User.id)
+            .join(UserOrganisation, UserOrganisation.user_id == User.id)
+            .where((UserOrganisation.organisation_id == org_id) & (User.email.in_(chunk)))
+        )
+        outcome.update((email, ("already_member", user_id)) for email, user_id in (await session.exec(stmt)).all())
+
+        fresh = [email for email in chunk if email not in outcome]
+        if not fresh:
+            continue
+        stmt = insert(Invite).returning(Invite.id, sort_by_parameter_order=True)
+        ids = (await session.execute(stmt, [
+            {"email": email, "organisation_id": org_id, "inviter_id": current_user.id, "accepted": False, "created_at": now}
+            for email in fresh
+        ])).scalars().all()
+        for email, invite_id in zip(fresh, ids):
+            outcome[email] = ("invited", invite_id)
+            enqueue(session, "invite.created", {
+                "invite_id": invite_id,
+                "email": email,
+                "organisation_id": org_id,
+                "inviter_id": current_user.id,
+            })
+
+    await session.commit()
+    outbox_worker.notify()
+    return email_results(data.emails, emails, outcome)
+
+
 @router.post("/accept")
-def accept_invite(
+async def accept_invite(
     org_id: int,
-    session: Session = Depends(get_session),
-    current_user: User = Depends(get_current_user)
+    role: Optional[str] = Depends(get_org_role),
+    session: AsyncSession = Depends(get_async_session),
+    current_user: Principal = Depends(get_current_principal)
 ):
     #look for pending invite
     stmt = select(Invite).where(
@@ -165,64 +340,68 @@ def accept_invite(
         (Invite.organisation_id == org_id) &
         (Invite.accepted == False)
     )
-    invite = session.exec(stmt).first()
+    invite = (await session.exec(stmt)).first()
 
     if not invite:
         raise HTTPException(status_code=404, detail="No valid invite found")
 
     #check if already a member
-    stmt = select(UserOrganisation).where(
-        (UserOrganisation.user_id == current_user.id) &
-        (UserOrganisation.organisation_id == org_id)
-    )
-    if session.exec(stmt).first():
+    if role:
         raise HTTPException(status_code=409, detail="Already a member")
 
-    #make a UserOrganisation link
-    link = UserOrganisation(user_id=current_user.id, organisation_id=org_id)
-    session.add(link)
-
     #mark invite as accepted
     invite.accepted = True
+    invite.accepted_at = datetime.utcnow()
     session.add(invite)
+    await bump_org_versions(session, [org_id])
+    enqueue(session, "invite.accepted", {"invite_id": invite.id, "user_id": current_user.id, "organisation_id": org_id})
+
+    #make a UserOrganisation link
+    link = UserOrganisation(user_id=current_user.id, organisation_id=org_id, change_seq=await next_change_seq(session))
+    session.add(link)
 
-    session.commit()
+    await session.commit()
+    outbox_worker.notify()
+    await invalidate_membership(current_user.id, org_id)
+    broker.publish(org_id, "membership-changed", {"user_id": current_user.id, "role": link.role})
     return {"message": f"Joined organisation {org_id}"}
 
 
 @router.patch("/promote")
-def promote_user(
+async def promote_user(
     org_id: int,
     data: PromoteUserRequest,
-    session: Session = Depends(get_session),
-    current_user: User = Depends(get_current_user),
+    role: Optional[str] = Depends(get_org_role),
+    session: AsyncSession = Depends(get_async_session),
+    current_user: Principal = Depends(get_current_principal),
 ):
     #check if current user is an owner
-    stmt = select(UserOrganisation).where(
-        (UserOrganisation.user_id == current_user.id) &
-        (UserOrganisation.organisation_id == org_id)
-    )
-    current_link = session.exec(stmt).first()
-    if current_link.role not in ["admin", "owner"]:
+    if role not in ADMIN_ROLES:
         raise HTTPException(status_code=403, detail="Not authorized")
 
     #find the user to promote
-    target_user = session.exec(select(User).where(User.email == data.email)).first()
+    target_user = (await session.exec(select(User).where(User.email == data.email))).first()
     if not target_user:
         raise HTTPException(status_code=404, detail="User not found")
 
-    # get their org link
-    stmt = select(UserOrganisation).where(
+    # update their org link in place, no row means they aren't a member
+    stmt = update(UserOrganisation).where(
         (UserOrganisation.user_id == target_user.id) &
         (UserOrganisation.organisation_id == org_id)
-    )
-    link = session.exec(stmt).first()
-    if not link:
+    ).values(role=data.role)
+    if (await session.exec(stmt)).rowcount == 0:
         raise HTTPException(status_code=404, detail="User not in organization")
-
-    # 4. Promote
-    link.role = data.role
-    session.add(link)
-    session.commit()
+    await bump_org_versions(session, [org_id])
+    enqueue(session, "member.promoted", {
+        "user_id": target_user.id,
+        "organisation_id": org_id,
+        "role": data.role,
+        "promoted_by": current_user.id,
+    })
+    await session.commit()
+    outbox_worker.notify()
+    await invalidate_membership(target_user.id, org_id)
+    await invalidate_user(target_user.id)
+    broker.publish(org_id, "membership-changed", {"user_id": target_user.id, "role": data.role})
 
     return {"message": f"{data.email} is now a {data.role}"}
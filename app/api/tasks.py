@@ -1,49 +1,275 @@
-from fastapi import APIRouter, Depends, HTTPException
-from app.auth.dependencies import get_current_user, get_session
+import csv
+import io
+import os
+import zlib
+from datetime import datetime
+from typing import Literal, Optional
+
+from fastapi import APIRouter, Body, Depends, Header, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from app.auth.dependencies import get_current_principal
+from app.auth.permissions import ADMIN_ROLES, get_role
+from app.auth.principals import Principal
 from app.models.task import Task
 from app.models.tasks_orgs import TaskOrganisation
-from app.models.user import User
 from app.models.organisations import UserOrganisation
+from app.models.changes import Tombstone
+from app.models.archive import TaskArchive, TaskOrganisationArchive
 
-from sqlmodel import Session, select
+from sqlalchemy import case, delete, exists, insert, literal, tuple_, union_all, update
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
 
-from app.db.session import get_session
-from app.schemas.user import TaskRead, TaskCreate
+from app.db.bulk import chunked, insert_ignore
+from app.db.changes import current_change_seq, next_change_seq, record_task_deletions, stamp_change_seq
+from app.db.search import search_tasks, search_terms
+from app.db.session import async_session_maker, get_async_session
+from app.db.stats import add_org_task_stats
+from app.db.versions import bump_org_versions, get_org_version
+from app.schemas.user import BULK_MAX_ITEMS, TaskRead, TaskCreate, TaskUpdate, TaskPage, TaskSearchPage, TaskBulkAssign, TaskBulkComplete, TaskBulkCompleteResult, BulkItemResult, BulkResult, TaskSyncPage, TaskLinkRead, TombstoneRead
+from app.utils.events import broker, event_stream
+from app.utils.http_cache import accepts_encoding, cached_json_response, make_etag
+from app.utils.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, decode_cursor, decode_sync_cursor, encode_sync_cursor, keyset_page, split_page
 
 router = APIRouter(prefix="/tasks", tags=["tasks"])
 
+#/tasks/all merges one page per org up to this many orgs, past it the EXISTS filter is cheaper.
+#SQLite also refuses compound selects of more than 500 terms
+VISIBLE_PAGE_MAX_ORGS = int(os.getenv("VISIBLE_PAGE_MAX_ORGS", "100"))
+EXPORT_BATCH_SIZE = 1000
+EXPORT_FIELDS = list(TaskRead.model_fields)
+
+
+class TaskListParams:
+    def __init__(
+        self,
+        limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+        cursor: Optional[str] = None,
+        completed: Optional[bool] = None,
+        created_after: Optional[datetime] = None,
+        created_before: Optional[datetime] = None,
+        title_prefix: Optional[str] = Query(None, min_length=1),
+        include_archived: bool = False,
+    ):
+        self.limit = limit
+        self.after = None
+        if cursor:
+            self.after = decode_cursor(cursor)
+            if not self.after:
+                raise HTTPException(status_code=400, detail="Invalid cursor")
+        self.completed = completed
+        self.created_after = created_after
+        self.created_before = created_before
+        self.title_prefix = title_prefix
+        self.include_archived = include_archived
+
+    def apply(self, stmt, model=Task, keys=None):
+        created_at, id = keys or (model.created_at, model.id)
+        if self.completed is not None:
+            stmt = stmt.where(model.completed == self.completed)
+        if self.created_after:
+            stmt = stmt.where(created_at >= self.created_after)
+        if self.created_before:
+            stmt = stmt.where(created_at < self.created_before)
+        if self.title_prefix:
+            stmt = stmt.where(model.title.startswith(self.title_prefix, autoescape=True))
+        return keyset_page(stmt, created_at, id, self.limit, self.after)
+
+
+def visible_to(user_id: int, task=Task, link=TaskOrganisation):
+    #tasks linked to any org the user belongs to, resolved in the database
+    in_user_org = exists().where(
+        (link.task_id == task.id) &
+        (link.organisation_id == UserOrganisation.organisation_id) &
+        (UserOrganisation.user_id == user_id)
+    )
+    #personal tasks are the user's own with no org link at all
+    personal = (task.owner_id == user_id) & ~exists().where(link.task_id == task.id)
+    return in_user_org | personal
+
+
+def org_page(params: TaskListParams, org_id: int, task=Task, link=TaskOrganisation):
+    #walks (organisation_id, created_at, task_id), a page reads about limit links whatever the org's size
+    stmt = select(task).join(link, link.task_id == task.id).where(link.organisation_id == org_id)
+    return params.apply(stmt, task, (link.created_at, link.task_id))
+
+
+def personal_page(params: TaskListParams, user_id: int, task=Task):
+    #walks (owner_id, linked, created_at, id), org tasks the user created are never read
+    return params.apply(select(task).where((task.owner_id == user_id) & (task.linked == False)), task)
+
+
+def visible_page(params: TaskListParams, user_id: int, org_ids: Optional[list[int]], task=Task, link=TaskOrganisation):
+    #a page of each of the user's orgs and of their personal tasks, merged in the database.
+    #cost follows the user's org count and page size, not how many tasks exist overall.
+    #None means too many orgs to list, the index is walked in order and each task checked instead
+    if org_ids is None:
+        return params.apply(select(task).where(visible_to(user_id, task, link)), task)
+    keys = [
+        params.apply(
+            select(link.task_id.label("id"), link.created_at).join(task, task.id == link.task_id).where(link.organisation_id == org_id),
+            task, (link.created_at, link.task_id),
+        ).subquery().select()
+        for org_id in org_ids
+    ]
+    keys.append(params.apply(
+        select(task.id, task.created_at).where((task.owner_id == user_id) & (task.linked == False)),
+        task,
+    ).subquery().select())
+    candidates = union_all(*keys).subquery()
+    return params.apply(select(task).where(task.id.in_(select(candidates.c.id))), task)
+
+
+def deletable_by(user_id: int):
+    #the owner, or an admin of any org the task is in
+    admin_of_linked_org = exists().where(
+        (TaskOrganisation.task_id == Task.id) &
+        (TaskOrganisation.organisation_id == UserOrganisation.organisation_id) &
+        (UserOrganisation.user_id == user_id) &
+        (UserOrganisation.role.in_(ADMIN_ROLES))
+    )
+    return (Task.owner_id == user_id) | admin_of_linked_org
+
+
+async def member_org_ids(session: AsyncSession, user_id: int, org_ids) -> set[int]:
+    #which of org_ids the user belongs to, one query per chunk
+    member = set()
+    for chunk in chunked(list(set(org_ids))):
+        stmt = select(UserOrganisation.organisation_id).where(
+            (UserOrganisation.user_id == user_id) &
+            (UserOrganisation.organisation_id.in_(chunk))
+        )
+        member.update((await session.exec(stmt)).all())
+    return member
+
+
+async def task_org_ids(session: AsyncSession, task_id: int) -> list[int]:
+    stmt = select(TaskOrganisation.organisation_id).where(TaskOrganisation.task_id == task_id)
+    return list((await session.exec(stmt)).all())
+
+
+async def list_page(session: AsyncSession, params: TaskListParams, stmt, archived=None) -> TaskPage:
+    rows = list((await session.exec(stmt)).all())
+    if params.include_archived and archived is not None:
+        #both are keyset pages in the same order, so the merged head is the union's page.
+        #a batch archived between the two reads can show up in both, ids tell them apart
+        rows += (await session.exec(archived)).all()
+        merged = {row.id: row for row in sorted(rows, key=lambda row: (row.created_at, row.id), reverse=True)}
+        rows = list(merged.values())[:params.limit + 1]
+    items, next_cursor = split_page(rows, params.limit)
+    return TaskPage(items=items, next_cursor=next_cursor)
+
 @router.post("/create", response_model=TaskRead)
-def create_task(
+async def create_task(
         task_data: TaskCreate,
-        session: Session = Depends(get_session),
-        current_user: User = Depends(get_current_user)
+        session: AsyncSession = Depends(get_async_session),
+        current_user: Principal = Depends(get_current_principal)
 ):
+    org_ids = list(dict.fromkeys(task_data.organisation_id or []))
+    missing = set(org_ids) - await member_org_ids(session, current_user.id, org_ids) if org_ids else set()
+    if missing:
+        raise HTTPException(status_code=403, detail=f"Not a member of organisations {sorted(missing)}")
+
+    if org_ids:
+        await bump_org_versions(session, org_ids)
+        await add_org_task_stats(session, {org_id: (1, 0) for org_id in org_ids})
+
     #org_id = current_user.org_id if task_data.in_organisation else None
+    seq = await next_change_seq(session)
     task = Task(
         title=task_data.title,
         description=task_data.description,
+        owner_id=current_user.id,
+        linked=bool(org_ids),
+        change_seq=seq,
         #organisation_id=org_id
     )
 
+    #flush for the id, task and links go out in one commit
     session.add(task)
-    session.commit()
-    session.refresh(task)
+    await session.flush()
 
-    if task_data.organisation_id:
-        for org_id in task_data.organisation_id:
-            link = TaskOrganisation(task_id=task.id, organisation_id=org_id)
-            session.add(link)
+    for org_id in org_ids:
+        link = TaskOrganisation(task_id=task.id, organisation_id=org_id, created_at=task.created_at, change_seq=seq)
+        session.add(link)
 
-    session.commit()
+    await session.commit()
+    data = TaskRead.model_validate(task).model_dump(mode="json")
+    for org_id in org_ids:
+        broker.publish(org_id, "task-created", data)
     return task
 
+@router.post("/bulk", response_model=BulkResult)
+async def create_tasks_bulk(
+        tasks_data: list[TaskCreate] = Body(..., max_length=BULK_MAX_ITEMS),
+        session: AsyncSession = Depends(get_async_session),
+        current_user: Principal = Depends(get_current_principal)
+):
+    #one membership query for every org mentioned in the batch
+    member_orgs = await member_org_ids(session, current_user.id, {org_id for item in tasks_data for org_id in item.organisation_id or []})
+
+    results = [None] * len(tasks_data)
+    accepted = []
+    for index, item in enumerate(tasks_data):
+        missing = set(item.organisation_id or []) - member_orgs
+        if missing:
+            results[index] = BulkItemResult(index=index, status="forbidden", detail=f"Not a member of organisations {sorted(missing)}")
+        else:
+            accepted.append(index)
+
+    #the tasks are new, so every org in an accepted item gains exactly one per item
+    added = {}
+    for index in accepted:
+        for org_id in set(tasks_data[index].organisation_id or []):
+            added[org_id] = added.get(org_id, 0) + 1
+    await bump_org_versions(session, added)
+    await add_org_task_stats(session, {org_id: (count, 0) for org_id, count in added.items()})
+
+    now = datetime.utcnow()
+    seq = await next_change_seq(session) if accepted else None
+    created = []
+    for chunk in chunked(accepted):
+        rows = [
+            {
+                "title": tasks_data[index].title,
+                "description": tasks_data[index].description,
+                "completed": False,
+                "created_at": now,
+                "owner_id": current_user.id,
+                "linked": bool(tasks_data[index].organisation_id),
+                "change_seq": seq,
+            }
+            for index in chunk
+        ]
+        stmt = insert(Task).returning(Task.id, sort_by_parameter_order=True)
+        ids = (await session.execute(stmt, rows)).scalars().all()
+
+        links = []
+        for index, task_id in zip(chunk, ids):
+            results[index] = BulkItemResult(index=index, id=task_id, status="created")
+            created.append((index, task_id))
+            for org_id in set(tasks_data[index].organisation_id or []):
+                links.append({"task_id": task_id, "organisation_id": org_id, "created_at": now, "change_seq": seq})
+        for link_chunk in chunked(links):
+            await session.execute(insert_ignore(session, TaskOrganisation), link_chunk)
+
+    await session.commit()
+    for index, task_id in created:
+        item = tasks_data[index]
+        data = TaskRead(id=task_id, title=item.title, description=item.description,
+                        completed=False, created_at=now, version=0).model_dump(mode="json")
+        for org_id in set(item.organisation_id or []):
+            broker.publish(org_id, "task-created", data)
+    return BulkResult(results=results)
+
 @router.patch("/update", response_model=TaskRead)
-def assign_task_to_org(
+async def assign_task_to_org(
         id: int,
-        session: Session = Depends(get_session),
-        current_user: User = Depends(get_current_user)
+        session: AsyncSession = Depends(get_async_session),
+        current_user: Principal = Depends(get_current_principal)
 ):
-    task = session.get(Task, id)
+    #tasks the caller can't see don't exist as far as they're concerned
+    task = (await session.exec(select(Task).where((Task.id == id) & visible_to(current_user.id)))).first()
     if not task:
         raise HTTPException(status_code=404, detail="Task not found")
 
@@ -54,71 +280,426 @@ def assign_task_to_org(
     stmt = select(TaskOrganisation).where(TaskOrganisation.task_id == id,
         TaskOrganisation.organisation_id == current_user.active_org_id
     )
-    existing_link = session.exec(stmt).first()
+    existing_link = (await session.exec(stmt)).first()
 
     if existing_link:
         raise HTTPException(status_code=400, detail="Task already assigned to this organisation")
 
-    #Add link
-    link = TaskOrganisation(task_id=id, organisation_id=current_user.active_org_id)
+    await bump_org_versions(session, [current_user.active_org_id])
+    await add_org_task_stats(session, {current_user.active_org_id: (1, int(task.completed))})
+    #Add link, the task counts as changed too since it's new to the org's members
+    seq = await next_change_seq(session)
+    link = TaskOrganisation(task_id=id, organisation_id=current_user.active_org_id, created_at=task.created_at, change_seq=seq)
     session.add(link)
-    session.commit()
-    session.refresh(task)
+    task.linked = True
+    task.change_seq = seq
+    await session.commit()
+    await session.refresh(task)
+    broker.publish(current_user.active_org_id, "task-assigned", TaskRead.model_validate(task).model_dump(mode="json"))
     return task
 
-@router.get("/org", response_model=list[TaskRead])
-def get_tasks(
-    session: Session = Depends(get_session),
-    current_user: User = Depends(get_current_user)
+@router.patch("/bulk-assign", response_model=BulkResult)
+async def assign_tasks_to_org_bulk(
+        data: TaskBulkAssign,
+        session: AsyncSession = Depends(get_async_session),
+        current_user: Principal = Depends(get_current_principal)
 ):
     if not current_user.active_org_id:
-        raise HTTPException(status_code=400, detail="No active organisation set")
+        raise HTTPException(status_code=403, detail="Not active org to set to")
+
+    org_id = current_user.active_org_id
+    outcome = {}
+    total, completed = 0, 0
+    for chunk in chunked(list(dict.fromkeys(data.task_ids))):
+        #links only for tasks the caller can see, existing links are skipped by the database
+        stmt = (
+            insert_ignore(session, TaskOrganisation)
+            .from_select(
+                ["task_id", "organisation_id", "created_at", "change_seq"],
+                select(Task.id, literal(org_id), Task.created_at, literal(0)).where(Task.id.in_(chunk) & visible_to(current_user.id)),
+            )
+            .returning(TaskOrganisation.task_id)
+        )
+        assigned = set((await session.execute(stmt)).scalars().all())
+        outcome.update((task_id, "assigned") for task_id in assigned)
+        if assigned:
+            stmt = update(Task).where(Task.id.in_(assigned)).values(linked=True).returning(Task.completed)
+            flags = (await session.execute(stmt)).scalars().all()
+            total, completed = total + len(flags), completed + sum(flags)
+
+        rest = [task_id for task_id in chunk if task_id not in assigned]
+        if rest:
+            found = set((await session.exec(select(Task.id).where(Task.id.in_(rest) & visible_to(current_user.id)))).all())
+            outcome.update((task_id, "already_assigned" if task_id in found else "not_found") for task_id in rest)
+
+    if total:
+        await bump_org_versions(session, [org_id])
+        await add_org_task_stats(session, {org_id: (total, completed)})
+        #tasks and links went in unstamped, the seq comes last
+        assigned = [task_id for task_id, status in outcome.items() if status == "assigned"]
+        seq = await next_change_seq(session)
+        await stamp_change_seq(session, seq, Task, Task.id, assigned)
+        await stamp_change_seq(session, seq, TaskOrganisation, TaskOrganisation.task_id, assigned, TaskOrganisation.organisation_id == org_id)
+    await session.commit()
+    for task_id, status in outcome.items():
+        if status == "assigned":
+            broker.publish(org_id, "task-assigned", {"id": task_id})
+    return BulkResult(results=[
+        BulkItemResult(index=index, id=task_id, status=outcome[task_id])
+        for index, task_id in enumerate(data.task_ids)
+    ])
 
+@router.patch("/bulk-complete", response_model=TaskBulkCompleteResult)
+async def complete_tasks_bulk(
+        data: TaskBulkComplete,
+        session: AsyncSession = Depends(get_async_session),
+        current_user: Principal = Depends(get_current_principal)
+):
+    if data.task_ids is None and data.organisation_id is None and not data.created_before and not data.title_prefix:
+        raise HTTPException(status_code=400, detail="Give task_ids or a filter")
+
+    criteria = visible_to(current_user.id) & (Task.completed != data.completed)
+    if data.organisation_id is not None:
+        criteria &= exists().where(
+            (TaskOrganisation.task_id == Task.id) & (TaskOrganisation.organisation_id == data.organisation_id)
+        )
+    if data.created_before:
+        criteria &= Task.created_at < data.created_before
+    if data.title_prefix:
+        criteria &= Task.title.startswith(data.title_prefix, autoescape=True)
+
+    #set based, the rows are never loaded, a filter is a single UPDATE and id lists go per chunk
     stmt = (
-        select(Task)
-        .join(TaskOrganisation)
-        .where(TaskOrganisation.organisation_id == current_user.active_org_id)
+        update(Task)
+        .values(
+            completed=data.completed,
+            completed_at=datetime.utcnow() if data.completed else None,
+            version=Task.version + 1,
+        )
+        .returning(Task.id)
+        .execution_options(synchronize_session=False)
     )
+    if data.task_ids is None:
+        updated = list((await session.execute(stmt.where(criteria))).scalars().all())
+    else:
+        updated = []
+        for chunk in chunked(list(dict.fromkeys(data.task_ids))):
+            updated.extend((await session.execute(stmt.where(criteria & Task.id.in_(chunk)))).scalars().all())
 
-    tasks = session.exec(stmt).all()
-    return tasks
+    by_org = {}
+    if updated:
+        for chunk in chunked(updated):
+            stmt = select(TaskOrganisation.organisation_id, TaskOrganisation.task_id).where(TaskOrganisation.task_id.in_(chunk))
+            for org_id, task_id in (await session.exec(stmt)).all():
+                by_org.setdefault(org_id, []).append(task_id)
+        await bump_org_versions(session, by_org)
+        step = 1 if data.completed else -1
+        await add_org_task_stats(session, {org_id: (0, step * len(task_ids)) for org_id, task_ids in by_org.items()})
+        await stamp_change_seq(session, await next_change_seq(session), Task, Task.id, updated)
+    await session.commit()
+    for org_id, task_ids in by_org.items():
+        broker.publish(org_id, "tasks-updated", {"ids": task_ids, "completed": data.completed})
+    return TaskBulkCompleteResult(updated=updated)
 
-@router.get("/personal", response_model=list[TaskRead])
-def get_personal_tasks(
-    session: Session = Depends(get_session),
-    current_user: User = Depends(get_current_user)
+@router.get("/org", response_model=TaskPage)
+async def get_tasks(
+    request: Request,
+    params: TaskListParams = Depends(),
+    session: AsyncSession = Depends(get_async_session),
+    current_user: Principal = Depends(get_current_principal)
 ):
-    stmt = (
-        select(Task)
-        .where(~Task.id.in_(select(TaskOrganisation.task_id)
-        ))
+    if not current_user.active_org_id:
+        raise HTTPException(status_code=400, detail="No active organisation set")
+    org_id = current_user.active_org_id
+
+    #the page can only change when the org version does, so that's all a revalidation reads
+    version = await get_org_version(session, org_id)
+    page_key = str(request.query_params)
+    etag = make_etag("tasks/org", org_id, version, page_key)
+
+    async def build() -> bytes:
+        archived = org_page(params, org_id, TaskArchive, TaskOrganisationArchive)
+        page = await list_page(session, params, org_page(params, org_id), archived)
+        return page.model_dump_json().encode("utf-8")
+
+    return await cached_json_response(request, etag, ("tasks/org", org_id, version, page_key), build)
+
+@router.get("/personal", response_model=TaskPage)
+async def get_personal_tasks(
+    params: TaskListParams = Depends(),
+    session: AsyncSession = Depends(get_async_session),
+    current_user: Principal = Depends(get_current_principal)
+):
+    archived = personal_page(params, current_user.id, TaskArchive)
+    return await list_page(session, params, personal_page(params, current_user.id), archived)
+
+@router.get("/all", response_model=TaskPage)
+async def get_all_user_tasks(
+    params: TaskListParams = Depends(),
+    session: AsyncSession = Depends(get_async_session),
+    current_user: Principal = Depends(get_current_principal)
+):
+    org_ids = list((await session.exec(
+        select(UserOrganisation.organisation_id)
+        .where(UserOrganisation.user_id == current_user.id)
+        .limit(VISIBLE_PAGE_MAX_ORGS + 1)
+    )).all())
+    if len(org_ids) > VISIBLE_PAGE_MAX_ORGS:
+        org_ids = None
+    archived = visible_page(params, current_user.id, org_ids, TaskArchive, TaskOrganisationArchive)
+    return await list_page(session, params, visible_page(params, current_user.id, org_ids), archived)
+
+@router.get("/sync", response_model=TaskSyncPage)
+async def sync_tasks(
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    session: AsyncSession = Depends(get_async_session),
+    current_user: Principal = Depends(get_current_principal)
+):
+    #read first, anything committed after this is picked up by the next call
+    current = await current_change_seq(session)
+    if not cursor:
+        return TaskSyncPage(next_cursor=encode_sync_cursor(current), reset=True)
+    decoded = decode_sync_cursor(cursor)
+    if decoded is None:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    since, at = decoded
+
+    my_orgs = select(UserOrganisation.organisation_id).where(UserOrganisation.user_id == current_user.id)
+    #(model, key, rows) per source. Changes are read in (change_seq, source, key) order,
+    #so a page can stop inside a transaction and the cursor says where
+    sources = [
+        (Task, (Task.id,), select(Task).where(visible_to(current_user.id))),
+        (TaskOrganisation, (TaskOrganisation.task_id, TaskOrganisation.organisation_id), select(TaskOrganisation).where(
+            TaskOrganisation.organisation_id.in_(my_orgs) |
+            exists().where((Task.id == TaskOrganisation.task_id) & (Task.owner_id == current_user.id))
+        )),
+        (Tombstone, (Tombstone.id,), select(Tombstone).where(
+            Tombstone.organisation_id.in_(my_orgs) | (Tombstone.owner_id == current_user.id)
+        )),
+    ]
+    if at is not None and not (at and 0 <= at[0] < len(sources) and len(at) == len(sources[at[0]][1]) + 1):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    #a new org brings its whole history along, a delta can't express that
+    joined = select(UserOrganisation.organisation_id).where(
+        (UserOrganisation.user_id == current_user.id) &
+        (UserOrganisation.change_seq > since)
     )
+    if (await session.exec(joined)).first():
+        return TaskSyncPage(next_cursor=encode_sync_cursor(current), reset=True)
+
+    def after(rank, model, key):
+        if at is None or rank < at[0]:
+            return model.change_seq > since
+        if rank > at[0]:
+            return model.change_seq >= since
+        return tuple_(model.change_seq, *key) > (since, *at[1:])
 
-    tasks = session.exec(stmt).all()
-    return tasks
+    #limit + 1 from each source, the merged head is the page
+    rows = []
+    for rank, (model, key, stmt) in enumerate(sources):
+        stmt = stmt.where(after(rank, model, key) & (model.change_seq <= current)).order_by(model.change_seq, *key)
+        for row in (await session.exec(stmt.limit(limit + 1))).all():
+            rows.append(((row.change_seq, rank, *[getattr(row, column.key) for column in key]), row))
+    rows.sort(key=lambda item: item[0])
+    page = rows[:limit]
+    if len(rows) > limit:
+        last = page[-1][0]
+        next_cursor = encode_sync_cursor(last[0], list(last[1:]))
+    else:
+        next_cursor = encode_sync_cursor(current)
 
-@router.get("/all", response_model=list[TaskRead])
-def get_all_user_tasks(
-    session: Session = Depends(get_session),
-    current_user: User = Depends(get_current_user)
+    tasks, links, tombstones = ([row for position, row in page if position[1] == rank] for rank in range(len(sources)))
+    deleted = {(row.kind, row.task_id): TombstoneRead.model_validate(row) for row in tombstones}
+    return TaskSyncPage(
+        tasks=tasks,
+        links=[TaskLinkRead.model_validate(row) for row in links],
+        deleted=list(deleted.values()),
+        next_cursor=next_cursor,
+        has_more=len(rows) > limit,
+    )
+
+@router.get("/search", response_model=TaskSearchPage)
+async def search_user_tasks(
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    offset: int = Query(0, ge=0),
+    session: AsyncSession = Depends(get_async_session),
+    current_user: Principal = Depends(get_current_principal)
 ):
-    #get all orgs the user belongs to
-    stmt_user_orgs = select(UserOrganisation.organisation_id).where(
-        UserOrganisation.user_id == current_user.id
+    dialect = session.bind.dialect.name
+    if not search_terms(q):
+        return TaskSearchPage(items=[])
+
+    #ranked results have no stable keyset, so this one pages by offset
+    stmt = search_tasks(select(Task).where(visible_to(current_user.id)), q, dialect)
+    rows = (await session.exec(stmt.offset(offset).limit(limit + 1))).all()
+    next_offset = offset + limit if len(rows) > limit else None
+    return TaskSearchPage(items=rows[:limit], next_offset=next_offset)
+
+async def export_org_tasks(org_id: int, format: str, compress: bool):
+    #gzip members can be flushed mid stream, so each batch reaches the client as soon as it's read
+    gzip = zlib.compressobj(wbits=31) if compress else None
+
+    def encode(text: str) -> bytes:
+        data = text.encode("utf-8")
+        return gzip.compress(data) + gzip.flush(zlib.Z_SYNC_FLUSH) if gzip else data
+
+    if format == "csv":
+        yield encode(",".join(EXPORT_FIELDS) + "\r\n")
+
+    #the request's session is closed before the body is sent, so the stream gets its own
+    async with async_session_maker() as session:
+        stmt = (
+            select(*[getattr(Task, field) for field in EXPORT_FIELDS])
+            .join(TaskOrganisation)
+            .where(TaskOrganisation.organisation_id == org_id)
+            .order_by(Task.created_at, Task.id)
+            .execution_options(yield_per=EXPORT_BATCH_SIZE)
+        )
+        result = await session.stream(stmt)
+        async for rows in result.partitions():
+            tasks = [TaskRead.model_validate(row._mapping) for row in rows]
+            if format == "csv":
+                buffer = io.StringIO()
+                writer = csv.writer(buffer)
+                for task in tasks:
+                    writer.writerow(task.model_dump(mode="json").values())
+                yield encode(buffer.getvalue())
+            else:
+                yield encode("".join(task.model_dump_json() + "\n" for task in tasks))
+
+    if gzip:
+        yield gzip.flush()
+
+@router.get("/export")
+async def export_tasks(
+    request: Request,
+    format: Literal["ndjson", "csv"] = "ndjson",
+    current_user: Principal = Depends(get_current_principal)
+):
+    if not current_user.active_org_id:
+        raise HTTPException(status_code=400, detail="No active organisation set")
+
+    compress = accepts_encoding(request, "gzip")
+    headers = {
+        "Content-Disposition": f'attachment; filename="org-{current_user.active_org_id}-tasks.{format}"',
+        #either way the body depends on Accept-Encoding, caches have to key on it
+        "Vary": "Accept-Encoding",
+    }
+    if compress:
+        headers["Content-Encoding"] = "gzip"
+    media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+
+    return StreamingResponse(
+        export_org_tasks(current_user.active_org_id, format, compress),
+        media_type=media_type,
+        headers=headers,
     )
-    user_org_ids = [org_id for org_id, in session.exec(stmt_user_orgs).all()]
 
-    #get all task IDs linked to the orgs
-    stmt_task_ids = select(TaskOrganisation.task_id).where(
-        TaskOrganisation.organisation_id.in_(user_org_ids)
+@router.get("/events")
+async def task_events(
+    last_event_id: Optional[str] = Header(None, alias="Last-Event-ID"),
+    session: AsyncSession = Depends(get_async_session),
+    current_user: Principal = Depends(get_current_principal)
+):
+    if not current_user.active_org_id:
+        raise HTTPException(status_code=400, detail="No active organisation set")
+    if not await get_role(session, current_user.id, current_user.active_org_id):
+        raise HTTPException(status_code=403, detail="You don't belong to this organisation.")
+
+    #server sent events, a reconnect sends Last-Event-ID and gets what it missed instead of refetching
+    return StreamingResponse(
+        event_stream(current_user.active_org_id, last_event_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
     )
-    org_task_ids = [task_id for task_id, in session.exec(stmt_task_ids).all()]
 
-    #get all org-linked tasks + personal tasks
-    stmt = select(Task).where(
-        (Task.id.in_(org_task_ids)) |
-        (~Task.id.in_(select(TaskOrganisation.task_id)))
+#declared last so the fixed paths above win over /{task_id}
+@router.patch("/{task_id}", response_model=TaskRead)
+async def update_task(
+    task_id: int,
+    data: TaskUpdate,
+    session: AsyncSession = Depends(get_async_session),
+    current_user: Principal = Depends(get_current_principal)
+):
+    changes = data.model_dump(exclude_unset=True, exclude={"version"})
+    if not changes:
+        raise HTTPException(status_code=400, detail="Nothing to update")
+    #optional in the body, but the columns aren't nullable
+    nulls = [field for field in ("title", "completed") if field in changes and changes[field] is None]
+    if nulls:
+        raise HTTPException(status_code=400, detail=f"{', '.join(nulls)} can't be null")
+    if "title" in changes and not changes["title"]:
+        raise HTTPException(status_code=400, detail="Title can't be empty")
+
+    #the counters need to know if completed really flips, the version check below keeps this read honest
+    previous = None
+    if "completed" in changes:
+        stmt = select(Task.completed).where((Task.id == task_id) & (Task.version == data.version))
+        previous = (await session.exec(stmt)).first()
+
+    if "completed" in changes:
+        #a task that was already done keeps its original completion time
+        changes["completed_at"] = case((Task.completed, Task.completed_at), else_=datetime.utcnow()) if changes["completed"] else None
+
+    #compare-and-swap, no row lock and no read before the write
+    stmt = (
+        update(Task)
+        .where((Task.id == task_id) & (Task.version == data.version) & visible_to(current_user.id))
+        .values(**changes, version=Task.version + 1)
+        .returning(Task)
+        .execution_options(synchronize_session=False)
     )
+    task = (await session.execute(stmt)).scalars().first()
+    if task is None:
+        #only a failed swap pays for finding out why
+        current = (await session.exec(select(Task.version).where((Task.id == task_id) & visible_to(current_user.id)))).first()
+        if current is None:
+            raise HTTPException(status_code=404, detail="Task not found")
+        raise HTTPException(status_code=409, detail=f"Task has changed, current version is {current}")
+
+    org_ids = await task_org_ids(session, task_id)
+    await bump_org_versions(session, org_ids)
+    if previous is not None and previous != task.completed:
+        await add_org_task_stats(session, {org_id: (0, 1 if task.completed else -1) for org_id in org_ids})
+    #flushed with the commit
+    task.change_seq = await next_change_seq(session)
+    await session.commit()
+    event = TaskRead.model_validate(task).model_dump(mode="json")
+    for org_id in org_ids:
+        broker.publish(org_id, "task-updated", event)
+    return task
+
+@router.delete("/{task_id}", status_code=204)
+async def delete_task(
+    task_id: int,
+    version: Optional[int] = None,
+    session: AsyncSession = Depends(get_async_session),
+    current_user: Principal = Depends(get_current_principal)
+):
+    stmt = select(Task.version, Task.completed, deletable_by(current_user.id)).where((Task.id == task_id) & visible_to(current_user.id))
+    row = (await session.exec(stmt)).first()
+    if row is None:
+        raise HTTPException(status_code=404, detail="Task not found")
+    current, completed, allowed = row
+    if not allowed:
+        raise HTTPException(status_code=403, detail="Only the owner or an org admin can delete this task")
+    if version is not None and version != current:
+        raise HTTPException(status_code=409, detail=f"Task has changed, current version is {current}")
 
-    tasks = session.exec(stmt).all()
-    return tasks
+    org_ids = await task_org_ids(session, task_id)
+    await bump_org_versions(session, org_ids)
+    await add_org_task_stats(session, {org_id: (-1, -int(completed)) for org_id in org_ids})
+    seq = await next_change_seq(session)
+    await record_task_deletions(session, [task_id], seq)
+    await session.execute(delete(TaskOrganisation).where(TaskOrganisation.task_id == task_id))
+    #still guarded by the version, an edit that landed since the read above wins
+    result = await session.execute(delete(Task).where((Task.id == task_id) & (Task.version == current)))
+    if result.rowcount == 0:
+        raise HTTPException(status_code=409, detail="Task has changed, reload and try again")
+    await session.commit()
+    for org_id in org_ids:
+        broker.publish(org_id, "task-deleted", {"id": task_id})
+    return Response(status_code=204)
@@ -1,54 +1,78 @@
 from fastapi import APIRouter, Depends, HTTPException
-from sqlmodel import  Session, select
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
 from app.models.user import User
 from app.schemas.user import UserCreate, UserLogin
-from app.db.session import get_session
-from app.utils.security import hash_password, verify_password
-from app.utils.token import create_access_token
-from datetime import timedelta
-from app.auth.dependencies import get_current_user
+from app.db.session import get_async_session
+from app.utils.security import PasswordHasherBusy, hash_password_async, needs_rehash, verify_password_async
+from app.auth.dependencies import get_current_principal
+from app.auth.principals import Principal, issue_token, load_principal
+from app.auth.rate_limit import by_email, rate_limit
 
 router = APIRouter(prefix="/users", tags=["users"])
 
-@router.post("/register")
-def register_user(user: UserCreate, session: Session = Depends(get_session)):
-    existing_user = session.exec(select(User).where(User.email == user.email)).first()
+def hasher_busy() -> HTTPException:
+    return HTTPException(status_code=503, detail="Server busy, try again shortly", headers={"Retry-After": "1"})
+
+#route dependencies run before the endpoint's own, so a rejected request never reaches the database or bcrypt
+@router.post("/register", dependencies=[Depends(rate_limit("register", "10/minute"))])
+async def register_user(user: UserCreate, session: AsyncSession = Depends(get_async_session)):
+    existing_user = (await session.exec(select(User).where(User.email == user.email))).first()
     if existing_user:
         raise HTTPException(status_code=400, detail="Email already registered")
 
+    #bcrypt runs in its own process pool, shed load rather than queue behind it
+    try:
+        hashed = await hash_password_async(user.password)
+    except PasswordHasherBusy:
+        raise hasher_busy()
+
     new_user = User(
         name=user.name,
         email=user.email,
-        password=hash_password(user.password))
+        password=hashed)
 
     #create new user
     session.add(new_user)
-    session.commit()
-    session.refresh(new_user)
+    await session.commit()
+    await session.refresh(new_user)
 
     return {"message": "User registered successfully", "user_id": new_user.id}
 
 @router.get("/users")
-def get_users(session: Session = Depends(get_session)):
-    users = session.exec(select(User)).all()
+async def get_users(session: AsyncSession = Depends(get_async_session)):
+    users = (await session.exec(select(User))).all()
     return users
 
-@router.post("/auth/login")
-def login_user(user: UserLogin, session: Session = Depends(get_session)):
+@router.post("/auth/login", dependencies=[
+    Depends(rate_limit("login", "30/minute")),
+    Depends(rate_limit("login_email", "10/minute", key=by_email)),
+])
+async def login_user(user: UserLogin, session: AsyncSession = Depends(get_async_session)):
     #look up the user using email
-    db_user = session.exec(select(User).where(User.email == user.email)).first()
-    if not db_user or not verify_password(user.password, db_user.password):
+    db_user = (await session.exec(select(User).where(User.email == user.email))).first()
+    try:
+        valid = db_user is not None and await verify_password_async(user.password, db_user.password)
+    except PasswordHasherBusy:
+        raise hasher_busy()
+    if not valid:
         raise HTTPException(status_code=400, detail="Invalid email or password")
 
+    #upgrade hashes made with an older work factor while we have the plain password
+    if needs_rehash(db_user.password):
+        try:
+            db_user.password = await hash_password_async(user.password)
+            session.add(db_user)
+            await session.commit()
+        except PasswordHasherBusy:
+            pass
 
-    access_token = create_access_token(
-        data = {"sub": str(db_user.id)},
-        expires_delta = timedelta(minutes=30)
-    )
+    #embed org and role so authenticated reads don't need to load the user
+    access_token = issue_token(await load_principal(session, db_user.id))
     return {"access_token": access_token, "token_type": "bearer"}
 
 @router.get("/auth/me")
-def get_me(current_user: User = Depends(get_current_user)):
+async def get_me(current_user: Principal = Depends(get_current_principal)):
     return {
         "id": current_user.id,
         "name": current_user.name,
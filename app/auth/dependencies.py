@@ -0,0 +1,58 @@
+import time
+
+from fastapi import Depends, HTTPException, status
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.auth.principals import Principal, cache_principal, cached_principal, is_stale, load_principal, principal_from_claims
+from app.db.session import get_async_session
+from app.models.user import User
+from app.utils.token import decode_access_token
+
+bearer_scheme = HTTPBearer()
+
+
+def credentials_error(detail: str = "Could not validate credentials") -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail=detail,
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+
+
+async def get_current_principal(
+    credentials: HTTPAuthorizationCredentials = Depends(bearer_scheme),
+    session: AsyncSession = Depends(get_async_session),
+) -> Principal:
+    token = credentials.credentials
+    principal = await cached_principal(token)
+    if principal:
+        return principal
+
+    payload = decode_access_token(token)
+    if not payload or "sub" not in payload:
+        raise credentials_error()
+
+    #trust the claims unless the user's org/role changed after the token was issued
+    principal = principal_from_claims(payload)
+    as_of = payload.get("iat", 0)
+    if principal is None or await is_stale(principal.id, as_of):
+        #the session only connects here, the common path never touches the database
+        principal = await load_principal(session, int(payload["sub"]))
+        as_of = time.time()
+        if not principal:
+            raise credentials_error("User no longer exists")
+
+    await cache_principal(token, principal, as_of, payload.get("exp"))
+    return principal
+
+
+async def get_current_user(
+    principal: Principal = Depends(get_current_principal),
+    session: AsyncSession = Depends(get_async_session),
+) -> User:
+    #for routes that modify the user row itself
+    user = await session.get(User, principal.id)
+    if not user:
+        raise credentials_error("User no longer exists")
+    return user
@@ -0,0 +1,49 @@
+import os
+from typing import Optional
+
+from fastapi import Depends
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.auth.dependencies import get_current_principal
+from app.auth.principals import Principal
+from app.db.session import get_async_session
+from app.models.organisations import UserOrganisation
+from app.utils.cache import cache_call, make_cache
+
+MEMBERSHIP_CACHE_SIZE = int(os.getenv("MEMBERSHIP_CACHE_SIZE", "50000"))
+MEMBERSHIP_CACHE_TTL = float(os.getenv("MEMBERSHIP_CACHE_TTL", "60"))
+
+ADMIN_ROLES = ("admin", "owner")
+
+#(user_id, org_id) -> role, "" remembers that they aren't a member
+_roles = make_cache("roles", MEMBERSHIP_CACHE_SIZE, MEMBERSHIP_CACHE_TTL)
+_UNKNOWN = object()
+
+
+async def get_role(session: AsyncSession, user_id: int, org_id: int) -> Optional[str]:
+    role = await cache_call(_roles, _roles.get, (user_id, org_id), _UNKNOWN)
+    if role is not _UNKNOWN:
+        return role or None
+
+    stmt = select(UserOrganisation.role).where(
+        (UserOrganisation.user_id == user_id) &
+        (UserOrganisation.organisation_id == org_id)
+    )
+    role = (await session.exec(stmt)).first()
+    await cache_call(_roles, _roles.set, (user_id, org_id), role or "")
+    return role
+
+
+async def invalidate_membership(user_id: int, org_id: int):
+    #call after any write to this user's UserOrganisation row
+    await cache_call(_roles, _roles.delete, (user_id, org_id))
+
+
+async def get_org_role(
+    org_id: int,
+    session: AsyncSession = Depends(get_async_session),
+    current_user: Principal = Depends(get_current_principal),
+) -> Optional[str]:
+    #the caller's role in the org_id query parameter, None if they aren't a member
+    return await get_role(session, current_user.id, org_id)
@@ -0,0 +1,118 @@
+import hashlib
+import os
+import time
+from dataclasses import asdict, dataclass
+from datetime import timedelta
+from typing import Optional
+
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.models.organisations import UserOrganisation
+from app.models.user import User
+from app.utils.cache import cache_call, make_cache
+from app.utils.token import ACCESS_TOKEN_EXPIRE_MINUTES, create_access_token
+
+PRINCIPAL_CACHE_SIZE = int(os.getenv("PRINCIPAL_CACHE_SIZE", "10000"))
+PRINCIPAL_CACHE_TTL = float(os.getenv("PRINCIPAL_CACHE_TTL", "300"))
+
+
+@dataclass(frozen=True)
+class Principal:
+    #what the token says about the caller, enough for most routes without a User row
+    id: int
+    email: str
+    name: str
+    active_org_id: Optional[int]
+    role: Optional[str]
+
+
+#sha256(token) -> (principal as a dict, when its facts were true, when the token expires)
+_principals = make_cache("principals", PRINCIPAL_CACHE_SIZE, PRINCIPAL_CACHE_TTL)
+#user_id -> time their claims last changed, kept as long as a token can live
+_invalidated = make_cache("invalidated_users", PRINCIPAL_CACHE_SIZE, ACCESS_TOKEN_EXPIRE_MINUTES * 60)
+
+
+def token_key(token: str) -> str:
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+
+async def invalidate_user(user_id: int):
+    #tokens issued before now carry stale org/role claims for this user
+    await cache_call(_invalidated, _invalidated.set, user_id, time.time())
+
+
+def _is_stale(user_id: int, as_of: float) -> bool:
+    changed_at = _invalidated.get(user_id)
+    return changed_at is not None and changed_at >= as_of
+
+
+async def is_stale(user_id: int, as_of: float) -> bool:
+    return await cache_call(_invalidated, _is_stale, user_id, as_of)
+
+
+def _cached_principal(token: str) -> Optional[Principal]:
+    entry = _principals.get(token_key(token))
+    if entry is None:
+        return None
+    fields, as_of, expires_at = entry
+    #the entry stands in for decoding the token, so it has to honour exp too
+    if expires_at is not None and expires_at <= time.time():
+        return None
+    if _is_stale(fields["id"], as_of):
+        return None
+    return Principal(**fields)
+
+
+async def cached_principal(token: str) -> Optional[Principal]:
+    #both lookups in one trip, the two caches share a backend
+    return await cache_call(_principals, _cached_principal, token)
+
+
+async def cache_principal(token: str, principal: Principal, as_of: float, expires_at: Optional[float] = None):
+    ttl = PRINCIPAL_CACHE_TTL if expires_at is None else min(PRINCIPAL_CACHE_TTL, expires_at - time.time())
+    if ttl > 0:
+        await cache_call(_principals, _principals.set, token_key(token), (asdict(principal), as_of, expires_at), ttl=ttl)
+
+
+def principal_from_claims(payload: dict) -> Optional[Principal]:
+    #tokens from before claims were embedded only carry "sub"
+    if "org" not in payload or "email" not in payload:
+        return None
+    return Principal(
+        id=int(payload["sub"]),
+        email=payload["email"],
+        name=payload.get("name", ""),
+        active_org_id=payload["org"],
+        role=payload.get("role"),
+    )
+
+
+async def load_principal(session: AsyncSession, user_id: int) -> Optional[Principal]:
+    stmt = (
+        select(User, UserOrganisation.role)
+        .join(
+            UserOrganisation,
+            (UserOrganisation.user_id == User.id) & (UserOrganisation.organisation_id == User.active_org_id),
+            isouter=True,
+        )
+        .where(User.id == user_id)
+    )
+    row = (await session.exec(stmt)).first()
+    if not row:
+        return None
+    user, role = row
+    return Principal(id=user.id, email=user.email, name=user.name, active_org_id=user.active_org_id, role=role)
+
+
+def issue_token(principal: Principal) -> str:
+    return create_access_token(
+        data={
+            "sub": str(principal.id),
+            "email": principal.email,
+            "name": principal.name,
+            "org": principal.active_org_id,
+            "role": principal.role,
+        },
+        expires_delta=timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES),
+    )
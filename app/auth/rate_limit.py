@@ -0,0 +1,67 @@
+import math
+import os
+from typing import Callable, Optional
+
+from fastapi import Depends, HTTPException, Request
+
+from app.auth.dependencies import get_current_principal
+from app.auth.principals import Principal
+from app.utils.buckets import bucket_store
+from app.utils.metrics import RATE_LIMITED
+
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() in ("1", "true", "yes", "on")
+#only behind a proxy that sets it, otherwise clients pick their own key
+RATE_LIMIT_TRUST_FORWARDED = os.getenv("RATE_LIMIT_TRUST_FORWARDED", "false").lower() in ("1", "true", "yes", "on")
+
+PERIODS = {"second": 1, "minute": 60, "hour": 3600, "day": 86400}
+
+
+def parse_rate(rate: str) -> tuple[float, float]:
+    #"10/minute" -> bursts of 10, refilled at 10 per minute
+    count, _, period = rate.partition("/")
+    capacity = float(count)
+    return capacity, capacity / PERIODS[period.strip()]
+
+
+def client_ip(request: Request) -> str:
+    if RATE_LIMIT_TRUST_FORWARDED:
+        forwarded = request.headers.get("x-forwarded-for")
+        if forwarded:
+            return forwarded.split(",")[0].strip()
+    return request.client.host if request.client else "unknown"
+
+
+async def by_ip(request: Request) -> Optional[str]:
+    return client_ip(request)
+
+
+async def by_email(request: Request) -> Optional[str]:
+    #the body is cached on the request, FastAPI parses the same bytes for the endpoint
+    try:
+        email = (await request.json()).get("email")
+    except (ValueError, AttributeError):
+        return None
+    return email.strip().lower() if isinstance(email, str) else None
+
+
+async def by_user(current_user: Principal = Depends(get_current_principal)) -> Optional[str]:
+    return str(current_user.id)
+
+
+def rate_limit(name: str, rate: str, key: Callable = by_ip):
+    #a route dependency; RATE_LIMIT_<NAME>=count/period overrides the rate without a deploy
+    capacity, refill = parse_rate(os.getenv(f"RATE_LIMIT_{name.upper()}", rate))
+
+    async def check(identity: Optional[str] = Depends(key)):
+        if not RATE_LIMIT_ENABLED or identity is None:
+            return
+        wait = await bucket_store.take(f"{name}:{identity}", capacity, refill)
+        if wait > 0:
+            RATE_LIMITED.inc(limit=name)
+            raise HTTPException(
+                status_code=429,
+                detail="Too many requests, slow down",
+                headers={"Retry-After": str(math.ceil(wait))},
+            )
+
+    return check
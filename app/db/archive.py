@@ -0,0 +1,108 @@
+import argparse
+import os
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import delete, func, insert, literal, select, update
+from sqlmodel import Session
+
+from app.db.changes import NEXT_CHANGE_SEQ, task_tombstones
+from app.models.archive import InviteArchive, TaskArchive, TaskOrganisationArchive
+from app.models.invites import Invite
+from app.models.organisations import Organisation
+from app.models.task import Task
+from app.models.tasks_orgs import TaskOrganisation
+
+ARCHIVE_TASKS_AFTER_DAYS = float(os.getenv("ARCHIVE_TASKS_AFTER_DAYS", "90"))
+ARCHIVE_INVITES_AFTER_DAYS = float(os.getenv("ARCHIVE_INVITES_AFTER_DAYS", "30"))
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "1000"))
+
+
+def move_rows(session: Session, source, target, key, ids: list[int], **extra):
+    #copy then delete by id, the target has the source's columns plus any extra ones
+    columns = [column.name for column in source.__table__.columns]
+    rows = select(*source.__table__.columns, *[literal(value) for value in extra.values()]).where(key.in_(ids))
+    session.execute(insert(target).from_select(columns + list(extra), rows))
+    session.execute(delete(source).where(key.in_(ids)))
+
+
+def next_batch(session: Session, model, criteria, after: int, size: int) -> list[int]:
+    stmt = (
+        select(model.id)
+        .where(criteria & (model.id > after))
+        .order_by(model.id)
+        .limit(size)
+        #concurrent archivers split the work instead of waiting on each other
+        .with_for_update(skip_locked=True)
+    )
+    return list(session.execute(stmt).scalars().all())
+
+
+def archive_tasks(session: Session, older_than: timedelta, batch_size: int = ARCHIVE_BATCH_SIZE, max_batches: Optional[int] = None) -> int:
+    #every batch commits on its own, so an interrupted run just picks up where it stopped next time
+    cutoff = datetime.utcnow() - older_than
+    done = Task.completed & (func.coalesce(Task.completed_at, Task.created_at) < cutoff)
+    moved, after, batches = 0, 0, 0
+    while max_batches is None or batches < max_batches:
+        ids = next_batch(session, Task, done, after, batch_size)
+        if not ids:
+            break
+        now = datetime.utcnow()
+        org_ids = session.execute(
+            select(TaskOrganisation.organisation_id).where(TaskOrganisation.task_id.in_(ids)).distinct()
+        ).scalars().all()
+
+        #the tasks leave the default listings, cached pages and ETags have to notice.
+        #OrgTaskStats is left alone, archived tasks still count towards their orgs
+        if org_ids:
+            session.execute(
+                update(Organisation)
+                .where(Organisation.id.in_(sorted(org_ids)))
+                .values(version=Organisation.version + 1)
+            )
+        #to sync clients an archived task is gone, as it is from a refetch of the default listings.
+        #the tombstones read the links, so they go in before anything moves
+        seq = session.execute(NEXT_CHANGE_SEQ).scalar_one()
+        session.execute(task_tombstones(ids, seq))
+        #links first, they reference the task
+        move_rows(session, TaskOrganisation, TaskOrganisationArchive, TaskOrganisation.task_id, ids)
+        move_rows(session, Task, TaskArchive, Task.id, ids, archived_at=now)
+        session.commit()
+
+        moved += len(ids)
+        after = ids[-1]
+        batches += 1
+    return moved
+
+
+def archive_invites(session: Session, older_than: timedelta, batch_size: int = ARCHIVE_BATCH_SIZE, max_batches: Optional[int] = None) -> int:
+    cutoff = datetime.utcnow() - older_than
+    accepted = Invite.accepted & (func.coalesce(Invite.accepted_at, Invite.created_at) < cutoff)
+    moved, after, batches = 0, 0, 0
+    while max_batches is None or batches < max_batches:
+        ids = next_batch(session, Invite, accepted, after, batch_size)
+        if not ids:
+            break
+        move_rows(session, Invite, InviteArchive, Invite.id, ids, archived_at=datetime.utcnow())
+        session.commit()
+
+        moved += len(ids)
+        after = ids[-1]
+        batches += 1
+    return moved
+
+
+if __name__ == "__main__":
+    from app.db.session import engine
+
+    parser = argparse.ArgumentParser(description="Move completed tasks and accepted invites into the archive tables.")
+    parser.add_argument("--task-days", type=float, default=ARCHIVE_TASKS_AFTER_DAYS, help="archive tasks completed longer ago than this")
+    parser.add_argument("--invite-days", type=float, default=ARCHIVE_INVITES_AFTER_DAYS, help="archive invites accepted longer ago than this")
+    parser.add_argument("--batch-size", type=int, default=ARCHIVE_BATCH_SIZE)
+    parser.add_argument("--max-batches", type=int, help="stop after this many batches per table, the next run carries on")
+    args = parser.parse_args()
+
+    with Session(engine) as session:
+        tasks = archive_tasks(session, timedelta(days=args.task_days), args.batch_size, args.max_batches)
+        invites = archive_invites(session, timedelta(days=args.invite_days), args.batch_size, args.max_batches)
+    print(f"Archived {tasks} tasks and {invites} invites")
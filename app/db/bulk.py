@@ -0,0 +1,21 @@
+from sqlalchemy.dialects import postgresql, sqlite
+
+#stays under SQLite's default bound-parameter limit with room for other clauses
+BULK_CHUNK_SIZE = 500
+
+
+def dialect_insert(session, model):
+    #the backend's own insert, which knows ON CONFLICT
+    if session.bind.dialect.name == "postgresql":
+        return postgresql.insert(model)
+    return sqlite.insert(model)
+
+
+def insert_ignore(session, model):
+    #INSERT ... ON CONFLICT DO NOTHING, both supported backends spell it the same way
+    return dialect_insert(session, model).on_conflict_do_nothing()
+
+
+def chunked(items: list, size: int = BULK_CHUNK_SIZE):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
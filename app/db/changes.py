@@ -0,0 +1,65 @@
+from typing import Iterable
+
+from sqlalchemy import insert, literal, select, true, update
+from sqlmodel import Session
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.db.bulk import chunked
+from app.models.changes import ChangeCounter, Tombstone
+from app.models.task import Task
+from app.models.tasks_orgs import TaskOrganisation
+
+
+#the archiver runs these statements on a sync session, the API through the async helpers below
+NEXT_CHANGE_SEQ = (
+    update(ChangeCounter)
+    .where(ChangeCounter.id == 1)
+    .values(value=ChangeCounter.value + 1)
+    .returning(ChangeCounter.value)
+)
+
+
+async def next_change_seq(session: AsyncSession) -> int:
+    #take it once per transaction. The counter row stays locked until commit, so
+    #sequence numbers become visible in order and sync never skips one that commits late.
+    #that lock serializes every writer, so take it last: reads, checks and the org
+    #bookkeeping go first, and rows written before it get stamp_change_seq
+    return (await session.execute(NEXT_CHANGE_SEQ)).scalar_one()
+
+
+async def current_change_seq(session: AsyncSession) -> int:
+    return (await session.execute(select(ChangeCounter.value).where(ChangeCounter.id == 1))).scalar_one()
+
+
+async def stamp_change_seq(session: AsyncSession, seq: int, model, key, ids: Iterable, criteria=true()):
+    for chunk in chunked(list(ids)):
+        await session.execute(
+            update(model)
+            .where(key.in_(chunk) & criteria)
+            .values(change_seq=seq)
+            .execution_options(synchronize_session=False)
+        )
+
+
+def task_tombstones(task_ids: list[int], seq: int):
+    #run before the tasks go, one tombstone per org they were in, or one for a personal task
+    rows = (
+        select(literal("task"), Task.id, TaskOrganisation.organisation_id, Task.owner_id, literal(seq))
+        .select_from(Task)
+        .outerjoin(TaskOrganisation, TaskOrganisation.task_id == Task.id)
+        .where(Task.id.in_(task_ids))
+    )
+    return insert(Tombstone).from_select(["kind", "task_id", "organisation_id", "owner_id", "change_seq"], rows)
+
+
+async def record_task_deletions(session: AsyncSession, task_ids: Iterable[int], seq: int):
+    task_ids = list(task_ids)
+    if task_ids:
+        await session.execute(task_tombstones(task_ids, seq))
+
+
+def ensure_change_counter(engine):
+    with Session(engine) as session:
+        if session.get(ChangeCounter, 1) is None:
+            session.add(ChangeCounter(id=1, value=0))
+            session.commit()
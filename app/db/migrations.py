@@ -0,0 +1,196 @@
+import argparse
+from typing import Optional
+
+from sqlalchemy import exists, inspect, select, text, update
+from sqlalchemy.schema import CreateTable
+from sqlmodel import SQLModel, Session
+
+from app.db.changes import ensure_change_counter
+from app.db.search import ensure_search_index
+from app.db.stats import ensure_org_task_stats
+from app.models.archive import InviteArchive, TaskArchive, TaskOrganisationArchive
+from app.models.invites import Invite
+from app.models.organisations import Organisation
+from app.models.outbox import OutboxEvent
+from app.models.task import Task
+from app.models.tasks_orgs import TaskOrganisation
+from app.models.user import User
+
+
+def _column_ddl(column, dialect) -> str:
+    ddl = f"{dialect.identifier_preparer.quote(column.name)} {column.type.compile(dialect=dialect)}"
+    default = column.default.arg if column.default is not None and column.default.is_scalar else None
+    if default is not None:
+        literal = int(default) if isinstance(default, bool) else default
+        ddl += f" DEFAULT {literal!r}"
+        if not column.nullable:
+            ddl += " NOT NULL"
+    #a NOT NULL column without a default can't be added to a populated
+    #table, so it goes in as nullable and is left to a backfill
+    return ddl
+
+
+def add_missing_columns(engine) -> set[tuple[str, str]]:
+    #returns the (table, column) pairs it added, so backfills only run once
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    preparer = engine.dialect.identifier_preparer
+    added = set()
+    with engine.begin() as conn:
+        for table in SQLModel.metadata.tables.values():
+            if table.name not in existing_tables:
+                continue
+            existing = {col["name"] for col in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    conn.execute(text(
+                        f"ALTER TABLE {preparer.format_table(table)} ADD COLUMN {_column_ddl(column, engine.dialect)}"
+                    ))
+                    added.add((table.name, column.name))
+    return added
+
+
+def backfill_task_links(engine, added: set[tuple[str, str]]):
+    #rows from before a task's link state was copied around get it from the links themselves
+    pairs = [(Task, TaskOrganisation), (TaskArchive, TaskOrganisationArchive)]
+    with engine.begin() as conn:
+        for task, link in pairs:
+            if (link.__tablename__, "created_at") in added:
+                conn.execute(
+                    update(link)
+                    .where(link.created_at.is_(None))
+                    .values(created_at=select(task.created_at).where(task.id == link.task_id).scalar_subquery())
+                )
+            if (task.__tablename__, "linked") in added:
+                conn.execute(update(task).where(exists().where(link.task_id == task.id)).values(linked=True))
+
+
+def ensure_sqlite_autoincrement(engine):
+    #without AUTOINCREMENT SQLite hands the highest id out again once it's deleted, and archived
+    #rows keep their ids. Only CREATE TABLE can add it, so old tables are rebuilt in one transaction.
+    #the indexes and search triggers go with the old table, ensure_indexes and ensure_search_index put them back
+    if engine.dialect.name != "sqlite":
+        return
+    pairs = [(Task, TaskArchive), (Invite, InviteArchive)]
+    raw = engine.raw_connection()
+    conn = raw.driver_connection
+    #explicit BEGIN/COMMIT, the driver would otherwise commit each DDL statement on its own
+    isolation_level, conn.isolation_level = conn.isolation_level, None
+    foreign_keys = conn.execute("PRAGMA foreign_keys").fetchone()[0]
+    rebuilt_any = False
+    try:
+        for model, archive in pairs:
+            table = model.__table__
+            row = conn.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (table.name,)).fetchone()
+            if row is None or "AUTOINCREMENT" in row[0].upper():
+                continue
+            rebuilt = f"{table.name}__rebuild"
+            #the model's own DDL under a temporary name
+            create = str(CreateTable(table).compile(dialect=engine.dialect)).replace(
+                f"CREATE TABLE {engine.dialect.identifier_preparer.format_table(table)} (", f'CREATE TABLE "{rebuilt}" (', 1
+            )
+            columns = ", ".join(f'"{column.name}"' for column in table.columns)
+            conn.execute("PRAGMA foreign_keys=OFF")
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute(create)
+                conn.execute(f'INSERT INTO "{rebuilt}" ({columns}) SELECT {columns} FROM "{table.name}"')
+                conn.execute(f'DROP TABLE "{table.name}"')
+                conn.execute(f'ALTER TABLE "{rebuilt}" RENAME TO "{table.name}"')
+                #new ids start above every id either table has seen
+                newest = max(
+                    conn.execute(f'SELECT coalesce(max(id), 0) FROM "{table.name}"').fetchone()[0],
+                    conn.execute(f'SELECT coalesce(max(id), 0) FROM "{archive.__tablename__}"').fetchone()[0],
+                )
+                conn.execute("DELETE FROM sqlite_sequence WHERE name = ?", (table.name,))
+                conn.execute("INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)", (table.name, newest))
+                conn.execute("COMMIT")
+                rebuilt_any = True
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+    finally:
+        conn.execute(f"PRAGMA foreign_keys={foreign_keys}")
+        conn.isolation_level = isolation_level
+        raw.close()
+    if rebuilt_any:
+        #other pooled connections still hold the old schema, and CREATE INDEX is checked against it
+        engine.dispose()
+
+
+def ensure_indexes(engine):
+    #create_all only builds indexes for brand new tables, so add any that
+    #were declared after the table already existed
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    with engine.begin() as conn:
+        for table in SQLModel.metadata.tables.values():
+            if table.name not in existing_tables:
+                continue
+            existing = {ix["name"] for ix in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in existing:
+                    index.create(bind=conn)
+
+
+#indexes a model no longer declares, another index covers what they were for
+RETIRED_INDEXES = ["ix_task_owner_created_at_id"]
+
+
+def drop_retired_indexes(engine):
+    with engine.begin() as conn:
+        for name in RETIRED_INDEXES:
+            conn.execute(text(f"DROP INDEX IF EXISTS {engine.dialect.identifier_preparer.quote(name)}"))
+
+
+def migrate_schema(engine):
+    added = add_missing_columns(engine)
+    backfill_task_links(engine, added)
+    ensure_sqlite_autoincrement(engine)
+    ensure_indexes(engine)
+    drop_retired_indexes(engine)
+    ensure_search_index(engine)
+    ensure_change_counter(engine)
+    ensure_org_task_stats(engine)
+
+
+def backfill_task_owners(session: Session, default_owner_id: Optional[int] = None) -> int:
+    #org tasks predate owner_id, the best guess is the creator of the first org they're in
+    first_org_creator = (
+        select(Organisation.creator_id)
+        .join(TaskOrganisation, TaskOrganisation.organisation_id == Organisation.id)
+        .where(TaskOrganisation.task_id == Task.id)
+        .order_by(TaskOrganisation.organisation_id)
+        .limit(1)
+        .scalar_subquery()
+    )
+    updated = session.exec(
+        update(Task)
+        .where(Task.owner_id.is_(None) & exists().where(TaskOrganisation.task_id == Task.id))
+        .values(owner_id=first_org_creator)
+    ).rowcount
+
+    #unlinked tasks carry no hint of who made them
+    if default_owner_id is not None:
+        updated += session.exec(
+            update(Task).where(Task.owner_id.is_(None)).values(owner_id=default_owner_id)
+        ).rowcount
+
+    session.commit()
+    return updated
+
+
+if __name__ == "__main__":
+    from app.db.session import engine
+
+    parser = argparse.ArgumentParser(description="Bring an existing database up to the current models.")
+    parser.add_argument("--backfill-task-owners", action="store_true")
+    parser.add_argument("--default-owner", type=int, help="owner for tasks that aren't linked to any org")
+    args = parser.parse_args()
+
+    SQLModel.metadata.create_all(engine)
+    migrate_schema(engine)
+    if args.backfill_task_owners:
+        with Session(engine) as session:
+            count = backfill_task_owners(session, args.default_owner)
+        print(f"Backfilled owner_id on {count} tasks")
@@ -0,0 +1,93 @@
+import re
+
+from sqlalchemy import column, func, inspect, literal_column, table, text
+
+from app.models.task import Task
+
+#external content FTS5 table over task, kept in step by triggers.
+#the last search term is a prefix, prefix= keeps short ones to one index lookup
+SQLITE_FTS_DDL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS task_fts USING fts5(
+        title, description, content='task', content_rowid='id', tokenize='unicode61 remove_diacritics 2',
+        prefix='2 3 4'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS task_fts_ai AFTER INSERT ON task BEGIN
+        INSERT INTO task_fts(rowid, title, description) VALUES (new.id, new.title, new.description);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS task_fts_ad AFTER DELETE ON task BEGIN
+        INSERT INTO task_fts(task_fts, rowid, title, description) VALUES ('delete', old.id, old.title, old.description);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS task_fts_au AFTER UPDATE OF title, description ON task BEGIN
+        INSERT INTO task_fts(task_fts, rowid, title, description) VALUES ('delete', old.id, old.title, old.description);
+        INSERT INTO task_fts(rowid, title, description) VALUES (new.id, new.title, new.description);
+    END""",
+]
+
+#an expression index needs no syncing, the planner matches the same expression in queries
+POSTGRES_FTS_DDL = [
+    """CREATE INDEX IF NOT EXISTS ix_task_search ON task USING GIN (
+        to_tsvector('simple', coalesce(title, '') || ' ' || coalesce(description, ''))
+    )""",
+]
+
+task_fts = table("task_fts", column("rowid"), column("rank"))
+
+
+def ensure_search_index(engine):
+    dialect = engine.dialect.name
+    if dialect == "sqlite":
+        is_new = "task_fts" not in inspect(engine).get_table_names()
+        with engine.begin() as conn:
+            #FTS5 options are fixed at creation, an index from before prefix= is built again
+            existing = conn.execute(text("SELECT sql FROM sqlite_master WHERE name = 'task_fts'")).scalar()
+            if existing is not None and "prefix=" not in existing:
+                for trigger in ("task_fts_ai", "task_fts_ad", "task_fts_au"):
+                    conn.execute(text(f"DROP TRIGGER IF EXISTS {trigger}"))
+                conn.execute(text("DROP TABLE task_fts"))
+                is_new = True
+            for ddl in SQLITE_FTS_DDL:
+                conn.execute(text(ddl))
+            if is_new:
+                #index whatever was in task before the triggers existed
+                conn.execute(text("INSERT INTO task_fts(task_fts) VALUES ('rebuild')"))
+    elif dialect == "postgresql":
+        with engine.begin() as conn:
+            for ddl in POSTGRES_FTS_DDL:
+                conn.execute(text(ddl))
+
+
+def search_terms(q: str) -> list[str]:
+    #both backends search for the same words, user input never reaches either query syntax
+    return re.findall(r"\w+", q)
+
+
+def fts5_query(q: str) -> str:
+    #every word has to match, the last one as a prefix
+    quoted = [f'"{term}"' for term in search_terms(q)]
+    if quoted:
+        quoted[-1] += "*"
+    return " ".join(quoted)
+
+
+def tsquery(q: str) -> str:
+    #fts5_query for to_tsquery. Only diacritics still differ: SQLite folds them, the 'simple' config doesn't
+    quoted = [f"'{term}'" for term in search_terms(q)]
+    if quoted:
+        quoted[-1] += ":*"
+    return " & ".join(quoted)
+
+
+def search_tasks(stmt, q: str, dialect: str):
+    #adds the match and relevance ordering to a select(Task)
+    if dialect == "postgresql":
+        document = func.to_tsvector(
+            "simple", func.coalesce(Task.title, "") + " " + func.coalesce(Task.description, "")
+        )
+        query = func.to_tsquery("simple", tsquery(q))
+        return stmt.where(document.op("@@")(query)).order_by(func.ts_rank(document, query).desc(), Task.id)
+
+    return (
+        stmt.join(task_fts, task_fts.c.rowid == Task.id)
+        .where(literal_column("task_fts").op("MATCH")(fts5_query(q)))
+        .order_by(task_fts.c.rank, Task.id)
+    )
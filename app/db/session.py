@@ -1,11 +1,154 @@
+import asyncio
+import os
+from contextlib import contextmanager
+
+from sqlalchemy import event, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.pool import QueuePool, StaticPool
 from sqlmodel import SQLModel, create_engine, Session
+from sqlmodel.ext.asyncio.session import AsyncSession
+from app.db.migrations import migrate_schema
+
+
+def _env_flag(name: str, default: bool) -> bool:
+    return os.getenv(name, str(default)).lower() in ("1", "true", "yes", "on")
+
+
+def run_migrations() -> bool:
+    #off in workers whose master already migrated, see gunicorn.conf.py. Read on every call,
+    #the master sets it after this module is imported and the workers inherit that import
+    return _env_flag("RUN_MIGRATIONS", True)
+
+
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///test.db")
+DB_ECHO = _env_flag("DB_ECHO", False)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_PRE_PING = _env_flag("DB_POOL_PRE_PING", True)
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+#connections each worker opens before taking traffic
+DB_POOL_PREWARM = int(os.getenv("DB_POOL_PREWARM", str(min(DB_POOL_SIZE, 4))))
+#any constant, it only has to be the same in every worker
+MIGRATION_LOCK_ID = 0x7461736b
+
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+
+
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    #WAL lets readers run alongside the single writer, NORMAL only fsyncs at checkpoints
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+    cursor.close()
+
+
+def _is_sqlite(url) -> bool:
+    return make_url(url).get_backend_name() == "sqlite"
+
+
+def _engine_options(url) -> dict:
+    if not _is_sqlite(url):
+        return {
+            "pool_size": DB_POOL_SIZE,
+            "max_overflow": DB_MAX_OVERFLOW,
+            "pool_pre_ping": DB_POOL_PRE_PING,
+            "pool_recycle": DB_POOL_RECYCLE,
+        }
+    if make_url(url).database in (None, "", ":memory:"):
+        #every connection to :memory: is a fresh database, so share one
+        return {"poolclass": StaticPool, "connect_args": {"check_same_thread": False}}
+    return {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "connect_args": {"check_same_thread": False},
+    }
+
+
+def _install_pragmas(url, sync_engine):
+    if _is_sqlite(url) and make_url(url).database not in (None, "", ":memory:"):
+        event.listen(sync_engine, "connect", set_sqlite_pragmas)
+
+
+def build_engine(url: str = DATABASE_URL, echo: bool = DB_ECHO):
+    options = _engine_options(url)
+    if not _is_sqlite(url):
+        options["poolclass"] = QueuePool
+    sync_engine = create_engine(url, echo=echo, **options)
+    _install_pragmas(url, sync_engine)
+    return sync_engine
+
+
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+}
+
+
+def async_database_url(url: str) -> str:
+    parsed = make_url(url)
+    driver = ASYNC_DRIVERS.get(parsed.drivername)
+    if driver:
+        parsed = parsed.set(drivername=driver)
+    return parsed.render_as_string(hide_password=False)
+
+
+def build_async_engine(url: str = DATABASE_URL, echo: bool = DB_ECHO):
+    async_engine = create_async_engine(async_database_url(url), echo=echo, **_engine_options(url))
+    _install_pragmas(url, async_engine.sync_engine)
+    return async_engine
+
+
+#the sync engine stays for scripts, migrations and tests, request handlers use the async one
+engine = build_engine()
+async_engine = build_async_engine()
+async_session_maker = async_sessionmaker(async_engine, class_=AsyncSession, expire_on_commit=False)
+
+@contextmanager
+def migration_lock(engine=engine):
+    #workers starting together take turns, the first migrates and the rest find nothing to do
+    url = engine.url
+    if url.get_backend_name() == "postgresql":
+        with engine.connect() as conn:
+            conn.execute(text("SELECT pg_advisory_lock(:id)"), {"id": MIGRATION_LOCK_ID})
+            try:
+                yield
+            finally:
+                conn.execute(text("SELECT pg_advisory_unlock(:id)"), {"id": MIGRATION_LOCK_ID})
+        return
+    if url.get_backend_name() == "sqlite" and url.database not in (None, "", ":memory:"):
+        import fcntl
+
+        with open(url.database + ".migrate.lock", "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+        return
+    yield
 
-DATABASE_URL = "sqlite:///test.db"
-engine = create_engine(DATABASE_URL, echo=True)
 
 def create_db_and_tables():
-    SQLModel.metadata.create_all(engine)
+    with migration_lock(engine):
+        SQLModel.metadata.create_all(engine)
+        migrate_schema(engine)
+
+
+async def prewarm_pool(count: int = DB_POOL_PREWARM):
+    #pays for connecting (and the sqlite pragmas) before the first request instead of during it
+    connections = await asyncio.gather(*(async_engine.connect() for _ in range(count)))
+    for connection in connections:
+        await connection.execute(text("SELECT 1"))
+        await connection.close()
 
 def get_session():
     with Session(engine) as session:
         yield session
+
+async def get_async_session():
+    async with async_session_maker() as session:
+        yield session
@@ -0,0 +1,95 @@
+import argparse
+
+from sqlalchemy import case, delete, func, insert, select, text, union_all
+from sqlmodel import Session
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.db.bulk import dialect_insert
+from app.models.archive import TaskArchive, TaskOrganisationArchive
+from app.models.stats import OrgTaskStats
+from app.models.task import Task
+from app.models.tasks_orgs import TaskOrganisation
+
+
+async def add_org_task_stats(session: AsyncSession, deltas: dict[int, tuple[int, int]]):
+    #org_id -> (total, completed) change, call inside the transaction that made it
+    rows = [
+        {"organisation_id": org_id, "total": total, "completed": completed}
+        for org_id, (total, completed) in sorted(deltas.items())
+        if total or completed
+    ]
+    if not rows:
+        return
+    stmt = dialect_insert(session, OrgTaskStats)
+    #an increment in the database, never a read-modify-write, so concurrent writers can't lose counts
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[OrgTaskStats.organisation_id],
+        set_={
+            "total": OrgTaskStats.total + stmt.excluded.total,
+            "completed": OrgTaskStats.completed + stmt.excluded.completed,
+        },
+    )
+    await session.execute(stmt, rows)
+
+
+def counted_from_links():
+    #archived tasks still belong to their orgs, the counters include them
+    links = union_all(
+        select(TaskOrganisation.organisation_id, Task.completed)
+        .join(Task, Task.id == TaskOrganisation.task_id),
+        select(TaskOrganisationArchive.organisation_id, TaskArchive.completed)
+        .join(TaskArchive, TaskArchive.id == TaskOrganisationArchive.task_id),
+    ).subquery()
+    return (
+        select(
+            links.c.organisation_id,
+            func.count().label("total"),
+            func.coalesce(func.sum(case((links.c.completed, 1), else_=0)), 0).label("completed"),
+        )
+        .group_by(links.c.organisation_id)
+    )
+
+
+def reconcile_org_task_stats(session: Session) -> int:
+    #rebuilds every counter from TaskOrganisation, returns how many orgs had drifted
+    if session.bind.dialect.name == "postgresql":
+        #waits for in-flight increments and holds new ones back until the rebuild commits
+        session.execute(text(f"LOCK TABLE {OrgTaskStats.__tablename__} IN EXCLUSIVE MODE"))
+    before = {row.organisation_id: (row.total, row.completed) for row in session.execute(
+        select(OrgTaskStats.organisation_id, OrgTaskStats.total, OrgTaskStats.completed)
+    )}
+    counted = {row.organisation_id: (row.total, row.completed) for row in session.execute(counted_from_links())}
+
+    session.execute(delete(OrgTaskStats))
+    if counted:
+        session.execute(insert(OrgTaskStats), [
+            {"organisation_id": org_id, "total": total, "completed": completed}
+            for org_id, (total, completed) in counted.items()
+        ])
+    session.commit()
+
+    #an org with no tasks left counts the same as no row
+    return sum(
+        1 for org_id in before.keys() | counted.keys()
+        if before.get(org_id, (0, 0)) != counted.get(org_id, (0, 0))
+    )
+
+
+def ensure_org_task_stats(engine):
+    #a database that had tasks before the counters existed starts from a full count
+    with Session(engine) as session:
+        has_stats = session.execute(select(OrgTaskStats.organisation_id).limit(1)).first()
+        has_links = session.execute(select(TaskOrganisation.task_id).limit(1)).first()
+        if has_links and not has_stats:
+            reconcile_org_task_stats(session)
+
+
+if __name__ == "__main__":
+    from app.db.session import engine
+
+    parser = argparse.ArgumentParser(description="Rebuild the per-organisation task counters from TaskOrganisation.")
+    parser.parse_args()
+
+    with Session(engine) as session:
+        drifted = reconcile_org_task_stats(session)
+    print(f"Rebuilt org task stats, {drifted} organisations had drifted")
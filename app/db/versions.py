@@ -0,0 +1,21 @@
+from typing import Iterable, Optional
+
+from sqlmodel import select, update
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.models.organisations import Organisation
+
+
+async def bump_org_versions(session: AsyncSession, org_ids: Iterable[int]):
+    #call inside the transaction that changes the org's tasks or members
+    org_ids = sorted(set(org_ids))
+    if org_ids:
+        await session.exec(
+            update(Organisation)
+            .where(Organisation.id.in_(org_ids))
+            .values(version=Organisation.version + 1)
+        )
+
+
+async def get_org_version(session: AsyncSession, org_id: int) -> Optional[int]:
+    return (await session.exec(select(Organisation.version).where(Organisation.id == org_id))).first()
@@ -0,0 +1,45 @@
+from sqlalchemy import Index, false
+from sqlmodel import SQLModel, Field
+from typing import Optional
+from datetime import datetime
+
+
+#same columns as the hot tables plus archived_at, rows keep their ids when they move
+class TaskArchive(SQLModel, table=True):
+    __table_args__ = (
+        Index("ix_taskarchive_created_at_id", "created_at", "id"),
+        Index("ix_taskarchive_owner_linked_created_at_id", "owner_id", "linked", "created_at", "id"),
+    )
+
+    id: int = Field(primary_key=True)
+    title: str
+    description: Optional[str] = None
+    completed: bool = True
+    created_at: datetime
+    completed_at: Optional[datetime] = None
+    owner_id: Optional[int] = Field(default=None, foreign_key="user.id")
+    linked: bool = Field(default=False, sa_column_kwargs={"server_default": false()})
+    version: int = Field(default=0, sa_column_kwargs={"server_default": "0"})
+    change_seq: int = Field(default=0, sa_column_kwargs={"server_default": "0"})
+    organization_id: Optional[int] = Field(default=None, foreign_key="organisation.id")
+    archived_at: datetime = Field(default_factory=datetime.utcnow)
+
+
+class TaskOrganisationArchive(SQLModel, table=True):
+    __table_args__ = (Index("ix_taskorganisationarchive_org_created_task", "organisation_id", "created_at", "task_id"),)
+
+    task_id: int = Field(primary_key=True)
+    organisation_id: int = Field(foreign_key="organisation.id", primary_key=True)
+    created_at: datetime
+    change_seq: int = Field(default=0, sa_column_kwargs={"server_default": "0"})
+
+
+class InviteArchive(SQLModel, table=True):
+    id: int = Field(primary_key=True)
+    email: str = Field(index=True)
+    organisation_id: int = Field(foreign_key="organisation.id", index=True)
+    inviter_id: int = Field(foreign_key="user.id")
+    accepted: bool = True
+    created_at: datetime
+    accepted_at: Optional[datetime] = None
+    archived_at: datetime = Field(default_factory=datetime.utcnow)
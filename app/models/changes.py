@@ -0,0 +1,19 @@
+from sqlmodel import SQLModel, Field
+from typing import Optional
+
+
+class ChangeCounter(SQLModel, table=True):
+    #a single row, every transaction that changes synced data takes the next value
+    id: int = Field(default=1, primary_key=True)
+    value: int = Field(default=0)
+
+
+class Tombstone(SQLModel, table=True):
+    #deleted and archived tasks leave one of these behind so sync clients learn about the removal
+    id: Optional[int] = Field(default=None, primary_key=True)
+    kind: str
+    task_id: int
+    #the org it was visible through, None for a personal task
+    organisation_id: Optional[int] = Field(default=None, index=True)
+    owner_id: Optional[int] = Field(default=None, index=True)
+    change_seq: int = Field(index=True)
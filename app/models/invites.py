@@ -1,12 +1,21 @@
 from pydantic import EmailStr
+from sqlalchemy import Index
 from sqlmodel import SQLModel, Field
 from typing import Optional
 from datetime import datetime
 
 class Invite(SQLModel, table=True):
+    #pending invite lookups, single and batched, filter on all three
+    #ids are never reused, archived invites keep theirs
+    __table_args__ = (
+        Index("ix_invite_org_email_accepted", "organisation_id", "email", "accepted"),
+        {"sqlite_autoincrement": True},
+    )
+
     id: Optional[int] = Field(default=None, primary_key=True)
     email: EmailStr
     organisation_id: int = Field(foreign_key="organisation.id")
     inviter_id: int = Field(foreign_key="user.id")
     accepted: bool = Field(default=False)
     created_at: datetime = Field(default_factory=datetime.utcnow)
+    accepted_at: Optional[datetime] = None
@@ -1,3 +1,4 @@
+from sqlalchemy import Index
 from sqlmodel import SQLModel, Field, Relationship
 from typing import Optional, List, TYPE_CHECKING
 from app.models.tasks_orgs import TaskOrganisation
@@ -6,20 +7,30 @@ class Organisation(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
     name: str
     creator_id: int = Field(foreign_key="user.id")
-    creator: Optional["User"] = Relationship(back_populates="created_organisations")
+    #bumped whenever the org's tasks or members change, ETags are derived from it
+    version: int = Field(default=0)
+    #user.active_org_id also points at organisation, so say which key this is
+    creator: Optional["User"] = Relationship(
+        back_populates="created_organisations",
+        sa_relationship_kwargs={"foreign_keys": "[Organisation.creator_id]"}
+    )
     users: List["UserOrganisation"] = Relationship(back_populates="organisation")
+    tasks: List["Task"] = Relationship(
+        back_populates="organisations",
+        link_model=TaskOrganisation
+    )
 
 class UserOrganisation(SQLModel, table=True):
+    __table_args__ = (Index("ix_userorganisation_user_role", "user_id", "role"),)
+
     user_id: int = Field(foreign_key="user.id", primary_key=True)
     organisation_id: int = Field(foreign_key="organisation.id", primary_key=True)
     role: str = Field(default="member")
+    #when the user joined, sync clients that joined since their cursor start over
+    change_seq: int = Field(default=0)
     user: "User" = Relationship(back_populates="organisations")
     organisation: "Organisation" = Relationship(back_populates="users")
 
-    tasks: list["Task"] = Relationship(
-        back_populates="organisations",
-        link_model=TaskOrganisation
-)
-
 if TYPE_CHECKING:
+    from .task import Task
     from .user import User
\ No newline at end of file
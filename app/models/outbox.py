@@ -0,0 +1,22 @@
+from sqlalchemy import JSON, Column, Index
+from sqlmodel import SQLModel, Field
+from typing import Optional
+from datetime import datetime
+
+
+class OutboxEvent(SQLModel, table=True):
+    #side effects written in the same transaction as the change, delivered later by the outbox worker
+    __table_args__ = (Index("ix_outboxevent_status_available_at", "status", "available_at"),)
+
+    id: Optional[int] = Field(default=None, primary_key=True)
+    kind: str
+    payload: dict = Field(default_factory=dict, sa_column=Column(JSON, nullable=False))
+    #pending -> done, or dead once it has run out of attempts
+    status: str = Field(default="pending")
+    attempts: int = Field(default=0)
+    available_at: datetime = Field(default_factory=datetime.utcnow)
+    #a worker's claim, another worker may take the event once it has passed
+    claimed_until: Optional[datetime] = None
+    last_error: Optional[str] = None
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    processed_at: Optional[datetime] = None
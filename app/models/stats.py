@@ -0,0 +1,8 @@
+from sqlmodel import SQLModel, Field
+
+
+class OrgTaskStats(SQLModel, table=True):
+    #maintained alongside every task write, rebuilt from scratch by `python -m app.db.stats`
+    organisation_id: int = Field(foreign_key="organisation.id", primary_key=True)
+    total: int = Field(default=0)
+    completed: int = Field(default=0)
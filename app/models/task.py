@@ -1,14 +1,35 @@
+from sqlalchemy import Index, false
 from sqlmodel import SQLModel, Field, Relationship
 from typing import Optional
 from datetime import datetime
 from app.models.tasks_orgs import TaskOrganisation
 
 class Task(SQLModel, table=True):
+    #keyset pagination walks (created_at, id), per owner for personal lists.
+    #the owner index also serves plain owner_id lookups
+    __table_args__ = (
+        Index("ix_task_created_at_id", "created_at", "id"),
+        Index("ix_task_owner_linked_created_at_id", "owner_id", "linked", "created_at", "id"),
+        #never hand a deleted or archived task's id out again
+        {"sqlite_autoincrement": True},
+    )
+
     id: Optional[int] = Field(default=None, primary_key=True)
     title: str
     description: Optional[str] = None
     completed: bool = False
     created_at: datetime = Field(default_factory=datetime.utcnow)
+    #archival moves tasks that have been done for long enough, see app/db/archive.py
+    completed_at: Optional[datetime] = None
+    owner_id: Optional[int] = Field(default=None, foreign_key="user.id")
+    #set once the task is in any org and never cleared, links only go away with the task.
+    #personal pages read the owner's unlinked tasks straight off the index
+    linked: bool = Field(default=False, sa_column_kwargs={"server_default": false()})
+    #the bookkeeping columns carry server defaults too, raw bulk loads like benchmarks/search.py leave them out
+    #bumped by every update, clients send it back for compare-and-swap
+    version: int = Field(default=0, sa_column_kwargs={"server_default": "0"})
+    #ChangeCounter value of the last transaction that touched it, sync reads by it
+    change_seq: int = Field(default=0, index=True, sa_column_kwargs={"server_default": "0"})
 
     organization_id: Optional[int] = Field(foreign_key="organisation.id")
     organisations: list["Organisation"] = Relationship(
@@ -1,6 +1,17 @@
+from sqlalchemy import Index
 from sqlmodel import SQLModel, Field
 from typing import Optional
+from datetime import datetime
 
 class TaskOrganisation(SQLModel, table=True):
+    #the primary key leads with task_id, org listings need the reverse.
+    #org pages walk (created_at, task_id) within one org, so the task's created_at is copied here
+    __table_args__ = (
+        Index("ix_taskorganisation_org_task", "organisation_id", "task_id"),
+        Index("ix_taskorganisation_org_created_task", "organisation_id", "created_at", "task_id"),
+    )
+
     task_id: Optional[int] = Field(default=None, foreign_key="task.id", primary_key=True)
     organisation_id: Optional[int] = Field(default=None, foreign_key="organisation.id", primary_key=True)
+    created_at: datetime
+    change_seq: int = Field(default=0, index=True, sa_column_kwargs={"server_default": "0"})
@@ -11,4 +11,7 @@ class User(SQLModel, table=True):
     active_org_id: Optional[int] = Field(default=None, foreign_key="organisation.id")
 
     organisations: list[UserOrganisation] = Relationship(back_populates="user")
-    created_organizations: list["Organisation"] = Relationship(back_populates="creator")
+    created_organisations: list["Organisation"] = Relationship(
+        back_populates="creator",
+        sa_relationship_kwargs={"foreign_keys": "[Organisation.creator_id]"}
+    )
@@ -1,4 +1,4 @@
-from pydantic import  BaseModel, EmailStr
+from pydantic import  BaseModel, EmailStr, Field
 from sqlmodel import SQLModel
 from typing import Optional
 from datetime import datetime
@@ -35,10 +35,32 @@ class OrganisationWithCreator(SQLModel):
 class InviteUserRequest(BaseModel):
     email: EmailStr
 
+BULK_MAX_EMAILS = 10000
+BULK_MAX_ITEMS = 10000
+
+class BulkEmailRequest(BaseModel):
+    #checked one by one in the handler, a bad address is reported instead of failing the request
+    emails: list[str] = Field(max_length=BULK_MAX_EMAILS)
+
+class EmailItemResult(BaseModel):
+    index: int
+    email: str
+    status: str
+    id: Optional[int] = None
+
+class EmailBulkResult(BaseModel):
+    results: list[EmailItemResult]
+
 class PromoteUserRequest(BaseModel):
     email: str
     role: str
 
+class OrgTaskStatsRead(BaseModel):
+    organisation_id: int
+    total: int
+    completed: int
+    open: int
+
 class TaskCreate(SQLModel):
     title: str
     description: Optional[str] = None
@@ -50,6 +72,68 @@ class TaskRead(SQLModel):
     description: Optional[str]
     completed: bool
     created_at: datetime
+    version: int = 0
+
+    class Config:
+        from_attributes=True
+
+class TaskUpdate(SQLModel):
+    title: Optional[str] = None
+    description: Optional[str] = None
+    completed: Optional[bool] = None
+    #the version the client last read, the update only applies if it's still current
+    version: int
+
+class TaskBulkComplete(SQLModel):
+    completed: bool = True
+    #either an explicit id list or a filter over the caller's tasks
+    task_ids: Optional[list[int]] = Field(None, max_length=BULK_MAX_ITEMS)
+    organisation_id: Optional[int] = None
+    created_before: Optional[datetime] = None
+    title_prefix: Optional[str] = None
+
+class TaskBulkCompleteResult(SQLModel):
+    updated: list[int]
+
+class TaskPage(SQLModel):
+    items: list[TaskRead]
+    next_cursor: Optional[str] = None
+
+class TaskBulkAssign(SQLModel):
+    task_ids: list[int] = Field(max_length=BULK_MAX_ITEMS)
+
+class BulkItemResult(SQLModel):
+    index: int
+    id: Optional[int] = None
+    status: str
+    detail: Optional[str] = None
+
+class BulkResult(SQLModel):
+    results: list[BulkItemResult]
+
+class TaskSearchPage(SQLModel):
+    items: list[TaskRead]
+    next_offset: Optional[int] = None
+
+class TaskLinkRead(SQLModel):
+    task_id: int
+    organisation_id: int
+
+    class Config:
+        from_attributes=True
+
+class TombstoneRead(SQLModel):
+    kind: str
+    task_id: int
 
     class Config:
         from_attributes=True
+
+class TaskSyncPage(SQLModel):
+    tasks: list[TaskRead] = []
+    links: list[TaskLinkRead] = []
+    deleted: list[TombstoneRead] = []
+    next_cursor: str
+    has_more: bool = False
+    #the caller's memberships changed, refetch /tasks/all and sync on from next_cursor
+    reset: bool = False
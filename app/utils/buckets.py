@@ -0,0 +1,51 @@
+import importlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000"))
+#"memory" or "package.module:attribute" naming a store shared by every worker
+RATE_LIMIT_STORE = os.getenv("RATE_LIMIT_STORE", "memory")
+
+
+class MemoryBucketStore:
+    #token buckets for this process only, a shared store implements the same take()
+
+    def __init__(self, maxsize: int = RATE_LIMIT_MAX_KEYS):
+        self.maxsize = maxsize
+        self._buckets: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    async def take(self, key: str, capacity: float, refill_per_second: float, cost: float = 1.0) -> float:
+        #returns 0 if the tokens were taken, otherwise how many seconds until they could be
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * refill_per_second)
+            if tokens >= cost:
+                tokens -= cost
+                wait = 0.0
+            else:
+                wait = (cost - tokens) / refill_per_second
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            #an evicted bucket starts over full, only the least recently seen keys go
+            while len(self._buckets) > self.maxsize:
+                self._buckets.popitem(last=False)
+        return wait
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+def load_store(name: str):
+    if name == "memory":
+        return MemoryBucketStore()
+    module, _, attribute = name.partition(":")
+    store = getattr(importlib.import_module(module), attribute)
+    return store() if isinstance(store, type) else store
+
+
+bucket_store = load_store(RATE_LIMIT_STORE)
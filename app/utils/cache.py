@@ -0,0 +1,176 @@
+import hashlib
+import importlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+from starlette.concurrency import run_in_threadpool
+
+#"memory" keeps every cache per process, "sqlite" shares them between the workers on a host,
+#"package.module:attribute" names a factory called as factory(name, maxsize, ttl).
+#cached values are JSON types or bytes, whatever the backend
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "memory")
+#no default, the file holds token data and belongs somewhere only the app user can reach
+CACHE_SQLITE_PATH = os.getenv("CACHE_SQLITE_PATH")
+
+
+class TTLCache:
+    #size-bounded LRU whose entries also expire after ttl seconds
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        if self.maxsize <= 0:
+            return
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key: Hashable):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+def open_private_file(path: str):
+    #created owner-only, and an existing file has to be ours and closed to everyone else.
+    #SQLite gives the -wal and -shm files the same mode
+    fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_NOFOLLOW, 0o600)
+    try:
+        info = os.fstat(fd)
+    finally:
+        os.close(fd)
+    if info.st_uid != os.getuid() or info.st_mode & 0o077:
+        raise RuntimeError(f"{path} must be owned by the app user with mode 0600")
+
+
+def database_namespace(url: str) -> str:
+    #apps on one host may point at the same cache file, their entries must never meet.
+    #a relative SQLite path is a different database in every working directory
+    from sqlalchemy.engine import make_url
+
+    url = make_url(url)
+    if url.get_backend_name() == "sqlite" and url.database and url.database != ":memory:":
+        url = url.set(database=os.path.abspath(url.database))
+    return hashlib.sha256(url.render_as_string(hide_password=True).encode("utf-8")).hexdigest()[:16]
+
+
+class SqliteCache:
+    #stand-in for a network store like redis: one file that every worker process reads and writes.
+    #Same interface as TTLCache, expiry uses wall clock time. bytes are stored as they are,
+    #anything else as JSON, so tuples come back as lists
+
+    _PRUNE_EVERY = 100
+    #a write can wait up to the busy timeout on another worker's, see cache_call
+    blocking = True
+
+    def __init__(self, name: str, maxsize: int, ttl: float, path: str, namespace: str = ""):
+        self.name = f"{namespace}:{name}" if namespace else name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._writes = 0
+        open_private_file(path)
+        self._conn = sqlite3.connect(path, timeout=5, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=OFF")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache ("
+            "name TEXT NOT NULL, key TEXT NOT NULL, expires_at REAL NOT NULL, value BLOB NOT NULL, "
+            "PRIMARY KEY (name, key))"
+        )
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM cache WHERE name = ? AND key = ? AND expires_at >= ?",
+                (self.name, repr(key), time.time()),
+            ).fetchone()
+        if row is None:
+            return default
+        #BLOB for bytes, TEXT for JSON, SQLite keeps the type each value went in with
+        return row[0] if isinstance(row[0], bytes) else json.loads(row[0])
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        if self.maxsize <= 0:
+            return
+        expires_at = time.time() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache (name, key, expires_at, value) VALUES (?, ?, ?, ?)",
+                (self.name, repr(key), expires_at, value if isinstance(value, bytes) else json.dumps(value)),
+            )
+            self._writes += 1
+            if self._writes % self._PRUNE_EVERY == 0:
+                self._prune()
+
+    def _prune(self):
+        #expired entries first, then whatever is closest to expiring until it fits
+        self._conn.execute("DELETE FROM cache WHERE name = ? AND expires_at < ?", (self.name, time.time()))
+        self._conn.execute(
+            "DELETE FROM cache WHERE name = ? AND key IN ("
+            "SELECT key FROM cache WHERE name = ? ORDER BY expires_at DESC LIMIT -1 OFFSET ?)",
+            (self.name, self.name, self.maxsize),
+        )
+
+    def delete(self, key: Hashable):
+        with self._lock:
+            self._conn.execute("DELETE FROM cache WHERE name = ? AND key = ?", (self.name, repr(key)))
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM cache WHERE name = ?", (self.name,))
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT count(*) FROM cache WHERE name = ?", (self.name,)).fetchone()[0]
+
+
+async def cache_call(cache, fn: Callable, *args, **kwargs):
+    #fn touches cache, a blocking backend runs it in the threadpool so the event loop never waits on it
+    if getattr(cache, "blocking", False):
+        return await run_in_threadpool(fn, *args, **kwargs)
+    return fn(*args, **kwargs)
+
+
+def make_cache(name: str, maxsize: int, ttl: float):
+    #every cache the app keeps goes through here, so CACHE_BACKEND switches them all at once
+    if CACHE_BACKEND == "memory":
+        return TTLCache(maxsize, ttl)
+    if CACHE_BACKEND == "sqlite":
+        from app.db.session import DATABASE_URL
+
+        if not CACHE_SQLITE_PATH:
+            raise RuntimeError("CACHE_BACKEND=sqlite needs CACHE_SQLITE_PATH, a file in a directory only the app user can write")
+        return SqliteCache(name, maxsize, ttl, CACHE_SQLITE_PATH, database_namespace(DATABASE_URL))
+    module, _, attribute = CACHE_BACKEND.partition(":")
+    return getattr(importlib.import_module(module), attribute)(name, maxsize, ttl)
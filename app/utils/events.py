@@ -0,0 +1,124 @@
+import asyncio
+import itertools
+import json
+import os
+import uuid
+from collections import deque
+from typing import Optional
+
+#per subscriber, a client that falls this far behind is dropped and resumes with Last-Event-ID
+EVENT_QUEUE_SIZE = int(os.getenv("EVENT_QUEUE_SIZE", "256"))
+#per org, how far back a reconnect can resume from
+EVENT_REPLAY_SIZE = int(os.getenv("EVENT_REPLAY_SIZE", "1000"))
+EVENT_HEARTBEAT_SECONDS = float(os.getenv("EVENT_HEARTBEAT_SECONDS", "15"))
+
+
+class Event:
+    __slots__ = ("id", "type", "data", "_encoded")
+
+    def __init__(self, id: int, type: str, data: dict):
+        self.id = id
+        self.type = type
+        self.data = data
+        self._encoded = None
+
+    def encode(self, epoch: str) -> bytes:
+        #serialised once however many subscribers it goes to
+        if self._encoded is None:
+            data = json.dumps(self.data, default=str)
+            self._encoded = f"id: {epoch}-{self.id}\nevent: {self.type}\ndata: {data}\n\n".encode("utf-8")
+        return self._encoded
+
+
+class Subscription:
+    def __init__(self, org_id: int):
+        self.org_id = org_id
+        self.queue: asyncio.Queue = asyncio.Queue(EVENT_QUEUE_SIZE)
+        self.overflowed = False
+
+    def push(self, event: Event):
+        if self.overflowed:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            #never block a publisher on a slow reader, end its stream instead
+            self.overflowed = True
+            self.queue.get_nowait()
+            self.queue.put_nowait(None)
+
+
+class EventBroker:
+    #in process fan-out, every worker process has its own broker and its own event ids
+
+    def __init__(self, replay_size: int = EVENT_REPLAY_SIZE):
+        #ids from another process or an earlier run mean nothing here, the epoch tells them apart
+        self.epoch = uuid.uuid4().hex[:12]
+        self._ids = itertools.count(1)
+        self._replay: dict[int, deque] = {}
+        self._replay_size = replay_size
+        #per org, the newest event id that has fallen out of the replay buffer
+        self._evicted: dict[int, int] = {}
+        self._subscribers: dict[int, set[Subscription]] = {}
+
+    def publish(self, org_id: int, type: str, data: dict) -> Event:
+        #call after the commit, so subscribers never see a change that was rolled back
+        event = Event(next(self._ids), type, data)
+        replay = self._replay.setdefault(org_id, deque(maxlen=self._replay_size))
+        if len(replay) == replay.maxlen:
+            self._evicted[org_id] = replay[0].id
+        replay.append(event)
+        for subscription in list(self._subscribers.get(org_id, ())):
+            subscription.push(event)
+        return event
+
+    def subscribe(self, org_id: int, last_event_id: Optional[str] = None) -> tuple[Subscription, Optional[list[Event]]]:
+        #returns the missed events, or None when they can't be replayed and the client must refetch
+        subscription = Subscription(org_id)
+        self._subscribers.setdefault(org_id, set()).add(subscription)
+        if not last_event_id:
+            return subscription, []
+        epoch, _, seq = last_event_id.partition("-")
+        if epoch != self.epoch or not seq.isdigit() or int(seq) < self._evicted.get(org_id, 0):
+            return subscription, None
+        replay = self._replay.get(org_id, ())
+        return subscription, [event for event in replay if event.id > int(seq)]
+
+    def unsubscribe(self, subscription: Subscription):
+        subscribers = self._subscribers.get(subscription.org_id)
+        if subscribers:
+            subscribers.discard(subscription)
+            if not subscribers:
+                del self._subscribers[subscription.org_id]
+
+    def subscriber_count(self, org_id: int) -> int:
+        return len(self._subscribers.get(org_id, ()))
+
+
+broker = EventBroker()
+
+
+async def event_stream(org_id: int, last_event_id: Optional[str] = None):
+    #subscribes on the first read, so a response that is never sent leaves nothing behind
+    subscription, missed = broker.subscribe(org_id, last_event_id)
+    try:
+        #tell the client how long to wait before reconnecting
+        yield b"retry: 3000\n\n"
+        if missed is None:
+            #too far behind to replay, the client should refetch and carry on from here
+            yield b"event: reset\ndata: {}\n\n"
+        else:
+            for event in missed:
+                yield event.encode(broker.epoch)
+        while True:
+            try:
+                event = await asyncio.wait_for(subscription.queue.get(), EVENT_HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                #comments keep proxies from closing an idle stream
+                yield b": keep-alive\n\n"
+                continue
+            if event is None:
+                return
+            yield event.encode(broker.epoch)
+    finally:
+        broker.unsubscribe(subscription)
@@ -0,0 +1,65 @@
+import hashlib
+import os
+from typing import Awaitable, Callable, Hashable
+
+from fastapi import Request, Response
+
+from app.utils.cache import cache_call, make_cache
+
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "1000"))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "300"))
+
+#serialized bodies, keys carry the org version so a bump makes old entries unreachable
+_responses = make_cache("responses", RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL)
+
+
+def make_etag(*parts) -> str:
+    return 'W/"' + hashlib.sha1(repr(parts).encode("utf-8")).hexdigest()[:24] + '"'
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    #If-None-Match uses weak comparison
+    wanted = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == wanted for tag in header.split(","))
+
+
+def accepts_encoding(request: Request, coding: str) -> bool:
+    #Accept-Encoding with q-values: "gzip;q=0" is a refusal, "*" covers codings not named
+    weights = {}
+    for item in request.headers.get("accept-encoding", "").split(","):
+        name, _, params = item.strip().partition(";")
+        if not name:
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key.lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        weights[name.strip().lower()] = q
+    q = weights.get(coding, weights.get("*", 0.0))
+    return q > 0
+
+
+async def cached_json_response(
+    request: Request,
+    etag: str,
+    key: Hashable,
+    build: Callable[[], Awaitable[bytes]],
+) -> Response:
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+
+    body = await cache_call(_responses, _responses.get, key)
+    if body is None:
+        body = await build()
+        await cache_call(_responses, _responses.set, key, body)
+    return Response(content=body, media_type="application/json", headers=headers)
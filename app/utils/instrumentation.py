@@ -0,0 +1,110 @@
+import logging
+import os
+import time
+from contextvars import ContextVar
+from typing import Optional
+
+from sqlalchemy import event
+
+from app.utils.metrics import BCRYPT_TIME, DB_ROWS, DB_STATEMENTS, DB_TIME, REQUEST_LATENCY, REQUEST_STATEMENTS
+
+#unset or 0 disables the slow query log
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "0"))
+
+slow_query_logger = logging.getLogger("app.db.slow")
+
+
+class RequestStats:
+    def __init__(self, scope: dict):
+        self.scope = scope
+        self.statements = 0
+        self.db_time = 0.0
+        self.rows = 0
+
+    @property
+    def route(self) -> str:
+        #the router writes the matched route into the scope, templates keep label cardinality bounded
+        route = self.scope.get("route")
+        return getattr(route, "path", "unmatched")
+
+
+_current: ContextVar[Optional[RequestStats]] = ContextVar("request_stats", default=None)
+
+
+def current_stats() -> Optional[RequestStats]:
+    return _current.get()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    #kept on the execution context, so a statement that raises takes its start time with it
+    if context is not None:
+        context.query_started = time.perf_counter()
+
+
+def _cursor_rows(cursor) -> int:
+    #the async adapters buffer the whole result on execute, server side cursors are left uncounted
+    if cursor.description is None or getattr(cursor, "server_side", False):
+        return 0
+    buffered = getattr(cursor, "_rows", None)
+    if buffered is not None:
+        return len(buffered)
+    return max(cursor.rowcount, 0)
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, "query_started", None)
+    if started is None:
+        return
+    elapsed = time.perf_counter() - started
+    stats = _current.get()
+    route = stats.route if stats else "background"
+    if stats:
+        stats.statements += 1
+        stats.db_time += elapsed
+        stats.rows += _cursor_rows(cursor)
+    if SLOW_QUERY_MS and elapsed * 1000 >= SLOW_QUERY_MS:
+        slow_query_logger.warning("slow query %.1fms route=%s: %s", elapsed * 1000, route, statement)
+
+
+def instrument_engine(engine):
+    target = getattr(engine, "sync_engine", engine)
+    event.listen(target, "before_cursor_execute", _before_cursor_execute)
+    event.listen(target, "after_cursor_execute", _after_cursor_execute)
+
+
+def record_bcrypt(operation: str, seconds: float):
+    stats = _current.get()
+    BCRYPT_TIME.observe(seconds, route=stats.route if stats else "background", operation=operation)
+
+
+class MetricsMiddleware:
+    #plain ASGI so streamed bodies are timed to their last byte
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats(scope)
+        token = _current.set(stats)
+        status = 500
+        start = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current.reset(token)
+            route = stats.route
+            REQUEST_LATENCY.observe(time.perf_counter() - start, route=route, method=scope["method"], status=status)
+            REQUEST_STATEMENTS.observe(stats.statements, route=route)
+            DB_STATEMENTS.inc(stats.statements, route=route)
+            DB_TIME.inc(stats.db_time, route=route)
+            DB_ROWS.inc(stats.rows, route=route)
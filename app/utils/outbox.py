@@ -0,0 +1,186 @@
+import asyncio
+import importlib
+import logging
+import os
+import random
+import time
+from collections import deque
+from contextlib import suppress
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import delete, select, update
+
+from app.db.session import async_session_maker
+from app.models.outbox import OutboxEvent
+from app.utils.metrics import OUTBOX_DELIVERIES
+
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "50"))
+OUTBOX_CONCURRENCY = int(os.getenv("OUTBOX_CONCURRENCY", "8"))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "8"))
+OUTBOX_DELIVERY_TIMEOUT = float(os.getenv("OUTBOX_DELIVERY_TIMEOUT", "30"))
+#a claim has to outlive a whole batch of timed out deliveries
+OUTBOX_CLAIM_SECONDS = float(os.getenv("OUTBOX_CLAIM_SECONDS", str(OUTBOX_DELIVERY_TIMEOUT * 4)))
+#picks up events enqueued by other processes, this process's own wake the worker straight away
+OUTBOX_POLL_SECONDS = float(os.getenv("OUTBOX_POLL_SECONDS", "2"))
+OUTBOX_RETRY_BASE_SECONDS = float(os.getenv("OUTBOX_RETRY_BASE_SECONDS", "2"))
+OUTBOX_RETRY_MAX_SECONDS = float(os.getenv("OUTBOX_RETRY_MAX_SECONDS", "600"))
+OUTBOX_RETENTION_HOURS = float(os.getenv("OUTBOX_RETENTION_HOURS", "168"))
+#"local" or "package.module:attribute" naming a sink object or a class to instantiate
+OUTBOX_SINK = os.getenv("OUTBOX_SINK", "local")
+
+logger = logging.getLogger("app.outbox")
+
+
+def enqueue(session, kind: str, payload: dict) -> OutboxEvent:
+    #only adds the row, it commits or rolls back with the caller's change
+    event = OutboxEvent(kind=kind, payload=payload)
+    session.add(event)
+    return event
+
+
+class LocalSink:
+    #stand-in delivery backend, logs and remembers the latest events so tests can inspect them
+
+    def __init__(self, keep: int = 1000):
+        self.delivered: deque = deque(maxlen=keep)
+
+    async def deliver(self, event_id: int, kind: str, payload: dict):
+        logger.info("outbox event %s %s %s", event_id, kind, payload)
+        self.delivered.append((event_id, kind, payload))
+
+
+def load_sink(name: str):
+    if name == "local":
+        return LocalSink()
+    module, _, attribute = name.partition(":")
+    sink = getattr(importlib.import_module(module), attribute)
+    return sink() if isinstance(sink, type) else sink
+
+
+def retry_delay(attempts: int) -> float:
+    #exponential with jitter so a backend outage doesn't come back to a thundering herd
+    delay = min(OUTBOX_RETRY_MAX_SECONDS, OUTBOX_RETRY_BASE_SECONDS * 2 ** (attempts - 1))
+    return delay * random.uniform(0.5, 1.0)
+
+
+class OutboxWorker:
+    def __init__(self, sink, session_maker=async_session_maker):
+        self.sink = sink
+        self.session_maker = session_maker
+        self._wakeup: Optional[asyncio.Event] = None
+        self._limit: Optional[asyncio.Semaphore] = None
+        self._task: Optional[asyncio.Task] = None
+        self._last_purge = 0.0
+
+    def notify(self):
+        #call after committing an enqueue
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def start(self):
+        #created here so they belong to the loop the worker runs on
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._limit = asyncio.Semaphore(OUTBOX_CONCURRENCY)
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            try:
+                claimed = await self.run_once()
+                if time.monotonic() - self._last_purge > 3600:
+                    await self.purge()
+            except Exception:
+                logger.exception("outbox batch failed")
+                claimed = 0
+            #a full batch means there's probably more waiting
+            if claimed < OUTBOX_BATCH_SIZE:
+                with suppress(asyncio.TimeoutError):
+                    await asyncio.wait_for(self._wakeup.wait(), OUTBOX_POLL_SECONDS)
+
+    async def run_once(self) -> int:
+        now = datetime.utcnow()
+        claimable = (
+            (OutboxEvent.status == "pending") &
+            (OutboxEvent.available_at <= now) &
+            (OutboxEvent.claimed_until.is_(None) | (OutboxEvent.claimed_until < now))
+        )
+        #the condition is repeated outside the subquery so two workers can't both claim a row
+        batch = (
+            select(OutboxEvent.id)
+            .where(claimable)
+            .order_by(OutboxEvent.available_at, OutboxEvent.id)
+            .limit(OUTBOX_BATCH_SIZE)
+            .with_for_update(skip_locked=True)
+        )
+        claim = (
+            update(OutboxEvent)
+            .where(OutboxEvent.id.in_(batch) & claimable)
+            .values(claimed_until=now + timedelta(seconds=OUTBOX_CLAIM_SECONDS))
+            .returning(OutboxEvent.id, OutboxEvent.kind, OutboxEvent.payload, OutboxEvent.attempts)
+        )
+        async with self.session_maker() as session:
+            claimed = (await session.execute(claim)).all()
+            await session.commit()
+        if not claimed:
+            return 0
+
+        if self._limit is None:
+            self._limit = asyncio.Semaphore(OUTBOX_CONCURRENCY)
+        errors = await asyncio.gather(*(self._deliver(event) for event in claimed))
+
+        now = datetime.utcnow()
+        async with self.session_maker() as session:
+            done = [event.id for event, error in zip(claimed, errors) if error is None]
+            if done:
+                await session.execute(
+                    update(OutboxEvent)
+                    .where(OutboxEvent.id.in_(done))
+                    .values(status="done", processed_at=now, claimed_until=None, last_error=None)
+                )
+            for event, error in zip(claimed, errors):
+                if error is None:
+                    continue
+                attempts = event.attempts + 1
+                values = {"attempts": attempts, "claimed_until": None, "last_error": error}
+                if attempts >= OUTBOX_MAX_ATTEMPTS:
+                    values.update(status="dead", processed_at=now)
+                    logger.error("outbox event %s (%s) gave up after %s attempts: %s", event.id, event.kind, attempts, error)
+                else:
+                    values["available_at"] = now + timedelta(seconds=retry_delay(attempts))
+                await session.execute(update(OutboxEvent).where(OutboxEvent.id == event.id).values(**values))
+            await session.commit()
+        return len(claimed)
+
+    async def _deliver(self, event) -> Optional[str]:
+        async with self._limit:
+            try:
+                await asyncio.wait_for(self.sink.deliver(event.id, event.kind, event.payload), OUTBOX_DELIVERY_TIMEOUT)
+            except Exception as exc:
+                OUTBOX_DELIVERIES.inc(kind=event.kind, outcome="failed")
+                logger.warning("outbox event %s (%s) failed: %r", event.id, event.kind, exc)
+                return repr(exc)[:1000]
+            OUTBOX_DELIVERIES.inc(kind=event.kind, outcome="delivered")
+            return None
+
+    async def purge(self):
+        #delivered events are only kept around for inspection
+        self._last_purge = time.monotonic()
+        cutoff = datetime.utcnow() - timedelta(hours=OUTBOX_RETENTION_HOURS)
+        async with self.session_maker() as session:
+            await session.execute(
+                delete(OutboxEvent).where((OutboxEvent.status == "done") & (OutboxEvent.processed_at < cutoff))
+            )
+            await session.commit()
+
+
+outbox_worker = OutboxWorker(load_sink(OUTBOX_SINK))
@@ -0,0 +1,58 @@
+import base64
+import json
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import tuple_
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+
+def encode_cursor(created_at: datetime, id: int) -> str:
+    raw = json.dumps([created_at.isoformat(), id]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Optional[tuple[datetime, int]]:
+    #returns None for anything we didn't hand out
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, id = json.loads(base64.urlsafe_b64decode(padded))
+        return datetime.fromisoformat(created_at), int(id)
+    except (ValueError, TypeError):
+        return None
+
+
+def encode_sync_cursor(seq: int, at: Optional[list[int]] = None) -> str:
+    #everything up to seq is done, or with at, up to that row within seq
+    payload = {"seq": seq} if at is None else {"seq": seq, "at": at}
+    raw = json.dumps(payload).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_sync_cursor(cursor: str) -> Optional[tuple[int, Optional[list[int]]]]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded))
+        at = payload.get("at")
+        return int(payload["seq"]), None if at is None else [int(value) for value in at]
+    except (ValueError, TypeError, KeyError, AttributeError):
+        return None
+
+
+def keyset_page(stmt, created_at, id, limit: int, after: Optional[tuple[datetime, int]] = None):
+    #newest first, (created_at, id) breaks ties so pages never overlap.
+    #the columns are the ones an index leads to, a link's copy of created_at walks the org's index
+    if after:
+        stmt = stmt.where(tuple_(created_at, id) < after)
+    return stmt.order_by(created_at.desc(), id.desc()).limit(limit + 1)
+
+
+def split_page(rows: list, limit: int):
+    #keyset_page fetches one extra row to know whether there is a next page
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    last = rows[-1]
+    return rows, encode_cursor(last.created_at, last.id)
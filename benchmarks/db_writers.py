@@ -0,0 +1,70 @@
+"""Concurrent writer throughput, stock engine vs build_engine().
+
+Run from the repo root:
+
+    python -m benchmarks.db_writers --threads 8 --transactions 200
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+
+from sqlalchemy import create_engine
+from sqlalchemy.exc import OperationalError
+from sqlmodel import Session, SQLModel
+
+from app.db.migrations import migrate_schema
+from app.db.session import build_engine
+from app.models.task import Task
+
+
+def run(engine, threads: int, transactions: int) -> dict:
+    SQLModel.metadata.create_all(engine)
+    migrate_schema(engine)
+    errors = 0
+    lock = threading.Lock()
+
+    def writer(n):
+        nonlocal errors
+        for i in range(transactions):
+            try:
+                with Session(engine) as session:
+                    session.add(Task(title=f"bench {n}-{i}", owner_id=n))
+                    session.commit()
+            except OperationalError:
+                #"database is locked" once the default 5s timeout runs out
+                with lock:
+                    errors += 1
+
+    workers = [threading.Thread(target=writer, args=(n,)) for n in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+    engine.dispose()
+
+    committed = threads * transactions - errors
+    return {"seconds": elapsed, "tx_per_sec": committed / elapsed, "errors": errors}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--transactions", type=int, default=200, help="per thread")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        stock_url = "sqlite:///" + os.path.join(tmp, "stock.db")
+        tuned_url = "sqlite:///" + os.path.join(tmp, "tuned.db")
+        results = {
+            #what app/db/session.py used to build
+            "stock": run(create_engine(stock_url), args.threads, args.transactions),
+            "tuned": run(build_engine(tuned_url, echo=False), args.threads, args.transactions),
+        }
+
+    print(f"{args.threads} threads x {args.transactions} transactions")
+    for name, result in results.items():
+        print(f"{name:>6}: {result['tx_per_sec']:8.1f} tx/s  {result['seconds']:6.2f}s  {result['errors']} errors")
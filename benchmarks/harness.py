@@ -0,0 +1,288 @@
+"""In-process load test for the API routers.
+
+Seeds a synthetic dataset into a temporary SQLite database, drives the
+real FastAPI app through httpx's ASGI transport and reports latency
+percentiles and throughput per scenario. Run from the repo root:
+
+    python -m benchmarks.harness                       # compare with benchmarks/baseline.json
+    python -m benchmarks.harness --save-baseline       # record a new baseline
+    python -m benchmarks.harness --users 500 --orgs 50 --tasks 50000 --requests 500
+
+Exits non-zero when a scenario's p95 or throughput is worse than the
+baseline by more than --tolerance. Baselines are only comparable on the
+same machine with the same dataset options.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+_tmp = tempfile.TemporaryDirectory()
+os.environ.setdefault("DATABASE_URL", "sqlite:///" + os.path.join(_tmp.name, "harness.db"))
+#the default cost makes register/login measure bcrypt and nothing else
+os.environ.setdefault("BCRYPT_ROUNDS", "4")
+#measure queueing latency rather than load shedding
+os.environ.setdefault("PASSWORD_HASH_MAX_PENDING", "10000")
+#every simulated client shares one address
+os.environ.setdefault("RATE_LIMIT_ENABLED", "false")
+#16 concurrent writers on one sqlite file can starve a waiter past the default 5s
+os.environ.setdefault("SQLITE_BUSY_TIMEOUT_MS", "30000")
+
+import httpx
+from sqlalchemy import insert
+from sqlmodel import Session
+
+import main
+from app.auth.principals import Principal, issue_token
+from app.db.session import async_engine, create_db_and_tables, engine
+from app.models.organisations import Organisation, UserOrganisation
+from app.models.task import Task
+from app.models.tasks_orgs import TaskOrganisation
+from app.models.user import User
+from app.utils.security import hash_password, shutdown_password_hasher
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baseline.json")
+PASSWORD = "benchmark-password"
+
+
+def seed(users: int, orgs: int, tasks: int, orgs_per_user: int, rng: random.Random) -> list[Principal]:
+    hashed = hash_password(PASSWORD)
+    now = datetime.utcnow()
+    with Session(engine) as session:
+        session.execute(insert(User), [
+            {"id": n + 1, "name": f"user {n}", "email": f"user{n}@bench.example.com", "password": hashed}
+            for n in range(users)
+        ])
+        session.execute(insert(Organisation), [
+            {"id": n + 1, "name": f"org {n}", "creator_id": n % users + 1, "version": 0}
+            for n in range(orgs)
+        ])
+
+        memberships = {}
+        for n in range(orgs):
+            memberships[(n % users + 1, n + 1)] = "owner"
+        for user_id in range(1, users + 1):
+            for org_id in rng.sample(range(1, orgs + 1), min(orgs_per_user, orgs)):
+                memberships.setdefault((user_id, org_id), rng.choice(["member", "member", "admin"]))
+        session.execute(insert(UserOrganisation), [
+            {"user_id": user_id, "organisation_id": org_id, "role": role}
+            for (user_id, org_id), role in memberships.items()
+        ])
+
+        #roughly 10% personal, 80% in one org, 10% shared by two
+        task_rows, link_rows = [], []
+        for n in range(tasks):
+            task_rows.append({
+                "id": n + 1,
+                "title": f"task {n}",
+                "description": "synthetic",
+                "completed": rng.random() < 0.3,
+                "created_at": now - timedelta(seconds=tasks - n),
+                "owner_id": rng.randint(1, users),
+            })
+            roll = rng.random()
+            fan_out = 0 if roll < 0.1 else 1 if roll < 0.9 else 2
+            task_rows[-1]["linked"] = fan_out > 0
+            for org_id in rng.sample(range(1, orgs + 1), min(fan_out, orgs)):
+                link_rows.append({"task_id": n + 1, "organisation_id": org_id, "created_at": task_rows[-1]["created_at"]})
+        for start in range(0, len(task_rows), 5000):
+            session.execute(insert(Task), task_rows[start:start + 5000])
+        for start in range(0, len(link_rows), 5000):
+            session.execute(insert(TaskOrganisation), link_rows[start:start + 5000])
+
+        #everyone works in the first org they joined
+        active = {}
+        for (user_id, org_id), role in sorted(memberships.items()):
+            active.setdefault(user_id, (org_id, role))
+        for user_id, (org_id, _) in active.items():
+            session.get(User, user_id).active_org_id = org_id
+        session.commit()
+
+    return [
+        Principal(id=user_id, email=f"user{user_id - 1}@bench.example.com", name=f"user {user_id - 1}",
+                  active_org_id=org_id, role=role)
+        for user_id, (org_id, role) in sorted(active.items())
+    ]
+
+
+class Context:
+    def __init__(self, principals: list[Principal], rng: random.Random):
+        self.principals = principals
+        self.rng = rng
+        self.headers = {p.id: {"Authorization": f"Bearer {issue_token(p)}"} for p in principals}
+        self.counter = 0
+
+    def pick(self) -> tuple[Principal, dict]:
+        principal = self.rng.choice(self.principals)
+        return principal, self.headers[principal.id]
+
+    def unique(self) -> int:
+        self.counter += 1
+        return self.counter
+
+
+def check(response: httpx.Response, *expected: int):
+    if response.status_code not in (expected or (200,)):
+        raise RuntimeError(f"{response.request.method} {response.request.url.path} -> {response.status_code}: {response.text[:200]}")
+
+
+async def register_login(client, ctx: Context):
+    n = ctx.unique()
+    email = f"new{n}-{os.getpid()}@bench.example.com"
+    check(await client.post("/users/register", json={"name": f"new {n}", "email": email, "password": PASSWORD}))
+    check(await client.post("/users/auth/login", json={"email": email, "password": PASSWORD}))
+
+
+async def task_create(client, ctx: Context):
+    principal, headers = ctx.pick()
+    check(await client.post("/tasks/create", headers=headers, json={
+        "title": f"bench task {ctx.unique()}",
+        "organisation_id": [principal.active_org_id],
+    }))
+
+
+async def tasks_all(client, ctx: Context):
+    _, headers = ctx.pick()
+    check(await client.get("/tasks/all", headers=headers))
+
+
+async def tasks_org(client, ctx: Context):
+    _, headers = ctx.pick()
+    check(await client.get("/tasks/org", headers=headers))
+
+
+async def invite_flow(client, ctx: Context):
+    #an admin/owner invites a brand new user, who accepts
+    inviter = ctx.rng.choice([p for p in ctx.principals if p.role in ("admin", "owner")])
+    n = ctx.unique()
+    email = f"invitee{n}-{os.getpid()}@bench.example.com"
+    check(await client.post("/users/register", json={"name": f"invitee {n}", "email": email, "password": PASSWORD}))
+    check(await client.post(
+        "/organisations/invite", params={"org_id": inviter.active_org_id},
+        headers=ctx.headers[inviter.id], json={"email": email},
+    ))
+    login = await client.post("/users/auth/login", json={"email": email, "password": PASSWORD})
+    check(login)
+    check(await client.post(
+        "/organisations/accept", params={"org_id": inviter.active_org_id},
+        headers={"Authorization": f"Bearer {login.json()['access_token']}"},
+    ))
+
+
+SCENARIOS = {
+    "register_login": register_login,
+    "task_create": task_create,
+    "tasks_all": tasks_all,
+    "tasks_org": tasks_org,
+    "invite_flow": invite_flow,
+}
+
+
+def percentile(values: list[float], pct: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+async def run_scenario(client, ctx: Context, scenario, requests: int, concurrency: int) -> dict:
+    timings = []
+    limit = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with limit:
+            start = time.perf_counter()
+            await scenario(client, ctx)
+            timings.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(requests)))
+    elapsed = time.perf_counter() - start
+    return {
+        "requests": requests,
+        "rps": requests / elapsed,
+        "p50_ms": statistics.median(timings) * 1000,
+        "p95_ms": percentile(timings, 95) * 1000,
+        "p99_ms": percentile(timings, 99) * 1000,
+    }
+
+
+async def run(args) -> dict:
+    rng = random.Random(args.seed)
+    create_db_and_tables()
+    start = time.perf_counter()
+    principals = seed(args.users, args.orgs, args.tasks, args.orgs_per_user, rng)
+    print(f"seeded {args.users} users, {args.orgs} orgs, {args.tasks} tasks in {time.perf_counter() - start:.1f}s")
+
+    ctx = Context(principals, rng)
+    results = {}
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for name in args.scenarios:
+            #a short warm up fills pools and caches the way a running server would have them
+            await run_scenario(client, ctx, SCENARIOS[name], min(20, args.requests), args.concurrency)
+            #best of several runs, single runs are too noisy to compare against a baseline
+            runs = [
+                await run_scenario(client, ctx, SCENARIOS[name], args.requests, args.concurrency)
+                for _ in range(args.repeat)
+            ]
+            results[name] = min(runs, key=lambda result: result["p95_ms"])
+    shutdown_password_hasher()
+    await async_engine.dispose()
+    return results
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        if result["p95_ms"] > base["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {result['p95_ms']:.1f}ms vs baseline {base['p95_ms']:.1f}ms")
+        if result["rps"] < base["rps"] * (1 - tolerance):
+            regressions.append(f"{name}: {result['rps']:.1f} req/s vs baseline {base['rps']:.1f} req/s")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="In-process load test for the API routers.")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--orgs", type=int, default=20)
+    parser.add_argument("--tasks", type=int, default=20000)
+    parser.add_argument("--orgs-per-user", type=int, default=3)
+    parser.add_argument("--requests", type=int, default=200, help="per scenario")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--repeat", type=int, default=3, help="runs per scenario, the best one is reported")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--scenarios", nargs="+", choices=list(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative slowdown")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+
+    print(f"{'scenario':<16}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name, result in results.items():
+        print(f"{name:<16}{result['rps']:>10.1f}{result['p50_ms']:>10.1f}{result['p95_ms']:>10.1f}{result['p99_ms']:>10.1f}")
+
+    status = 0
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"baseline written to {args.baseline}")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for line in regressions:
+            print("REGRESSION", line)
+        status = 1 if regressions else 0
+    _tmp.cleanup()
+    sys.exit(status)
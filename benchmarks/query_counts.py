@@ -0,0 +1,117 @@
+"""Check that every GET endpoint issues the same number of SQL statements
+whatever the size of the result, i.e. nothing loads rows one at a time.
+
+Run from the repo root, exits non-zero on a regression:
+
+    python -m benchmarks.query_counts
+"""
+import os
+import sys
+import tempfile
+
+_tmp = tempfile.TemporaryDirectory()
+os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(_tmp.name, "query_counts.db")
+#cached bodies would hide the queries we're counting
+os.environ["RESPONSE_CACHE_SIZE"] = "0"
+
+from fastapi.routing import APIRoute
+from fastapi.testclient import TestClient
+from sqlmodel import Session
+
+import main
+from app.db.query_counter import count_queries
+from app.db.session import async_engine, create_db_and_tables, engine
+from app.models.organisations import Organisation, UserOrganisation
+from app.models.task import Task
+from app.models.tasks_orgs import TaskOrganisation
+from app.models.user import User
+from app.utils.pagination import encode_sync_cursor
+from app.utils.security import hash_password
+
+PASSWORD = "password"
+#query parameters for endpoints that need them
+#stands in for the reader's active org, which differs between the two seeds
+ACTIVE_ORG = object()
+QUERY_PARAMS = {
+    "/organisations/stats": {"org_id": ACTIVE_ORG},
+    "/tasks/search": {"q": "task"},
+    "/tasks/org": {"limit": 500},
+    "/tasks/personal": {"limit": 500},
+    "/tasks/all": {"limit": 500, "include_archived": True},
+    "/tasks/sync": {"cursor": encode_sync_cursor(0)},
+}
+#never finish on their own
+STREAMING = {"/tasks/events"}
+
+
+def seed(scale: int) -> tuple[str, int]:
+    #one user in `scale` orgs, each created by a different user, with `scale` tasks of each kind
+    hashed = hash_password(PASSWORD, rounds=4)
+    email = f"reader{scale}@example.com"
+    with Session(engine) as session:
+        reader = User(name=f"reader {scale}", email=email, password=hashed)
+        session.add(reader)
+        session.flush()
+        for n in range(scale):
+            creator = User(name=f"creator {scale}-{n}", email=f"creator{scale}-{n}@example.com", password=hashed)
+            session.add(creator)
+            session.flush()
+            org = Organisation(name=f"org {scale}-{n}", creator_id=creator.id)
+            session.add(org)
+            session.flush()
+            session.add(UserOrganisation(user_id=creator.id, organisation_id=org.id, role="owner"))
+            session.add(UserOrganisation(user_id=reader.id, organisation_id=org.id, role="member" if n % 2 else "admin"))
+            reader.active_org_id = org.id
+
+            org_task = Task(title=f"org task {n}", owner_id=creator.id, linked=True)
+            personal_task = Task(title=f"personal task {n}", owner_id=reader.id)
+            session.add_all([org_task, personal_task])
+            session.flush()
+            session.add(TaskOrganisation(task_id=org_task.id, organisation_id=reader.active_org_id, created_at=org_task.created_at))
+        #give the active org `scale` tasks too
+        for n in range(scale):
+            task = Task(title=f"active task {n}", owner_id=reader.id, linked=True)
+            session.add(task)
+            session.flush()
+            session.add(TaskOrganisation(task_id=task.id, organisation_id=reader.active_org_id, created_at=task.created_at))
+        session.commit()
+        return email, reader.active_org_id
+
+
+def get_routes():
+    for route in main.app.routes:
+        if isinstance(route, APIRoute) and "GET" in route.methods and "{" not in route.path and route.path not in STREAMING:
+            yield route.path
+
+
+def measure(client: TestClient, email: str, org_id: int) -> dict:
+    token = client.post("/users/auth/login", json={"email": email, "password": PASSWORD}).json()["access_token"]
+    headers = {"Authorization": f"Bearer {token}"}
+    counts = {}
+    for path in get_routes():
+        params = {key: org_id if value is ACTIVE_ORG else value for key, value in QUERY_PARAMS.get(path, {}).items()}
+        #first call warms the principal and membership caches
+        client.get(path, params=params, headers=headers)
+        with count_queries(async_engine) as counter:
+            response = client.get(path, params=params, headers=headers)
+        counts[path] = (response.status_code, counter.count)
+    return counts
+
+
+if __name__ == "__main__":
+    create_db_and_tables()
+    #a 500 is reported like any other failure rather than raised
+    with TestClient(main.app, raise_server_exceptions=False) as client:
+        #600 orgs is past both VISIBLE_PAGE_MAX_ORGS and SQLite's 500-term compound select limit
+        runs = {scale: measure(client, *seed(scale)) for scale in (2, 40, 600)}
+
+    failed = False
+    for path in runs[2]:
+        statuses = [runs[scale][path][0] for scale in runs]
+        counts = [runs[scale][path][1] for scale in runs]
+        #an error response can be constant for the wrong reason
+        ok = len(set(counts)) == 1 and set(statuses) == {200}
+        failed |= not ok
+        print(f"{'ok ' if ok else 'FAIL'} {path:<28} " + ", ".join(f"{count:>3} at {scale}" for scale, count in zip(runs, counts)) + f" statements (HTTP {'/'.join(map(str, statuses))})")
+    _tmp.cleanup()
+    sys.exit(1 if failed else 0)
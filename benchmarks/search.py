@@ -0,0 +1,102 @@
+"""Task search latency, FTS index vs a LIKE scan.
+
+Run from the repo root (seeding 1M tasks takes a minute or two):
+
+    python -m benchmarks.search --tasks 1000000
+"""
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+from datetime import datetime
+
+from sqlalchemy import and_, select
+from sqlmodel import Session, SQLModel
+
+from app.db.migrations import migrate_schema
+from app.db.search import search_tasks
+from app.db.session import build_engine
+from app.models.task import Task
+
+SYLLABLES = ["ka", "lo", "mi", "ren", "tu", "sa", "vi", "dor", "ex", "pal", "qui", "zen", "bor", "ta", "ne"]
+
+
+def vocabulary(size: int, rng: random.Random) -> list[str]:
+    #a realistic spread of words, so most searches are selective
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choices(SYLLABLES, k=rng.randint(2, 4))))
+    return sorted(words)
+
+
+def seed(engine, count: int, words: list[str], batch: int = 20000):
+    rng = random.Random(42)
+    now = datetime.utcnow()
+    raw = engine.raw_connection()
+    try:
+        cursor = raw.cursor()
+        for start in range(0, count, batch):
+            rows = [
+                (
+                    " ".join(rng.choices(words, k=3)) + f" #{n}",
+                    " ".join(rng.choices(words, k=12)),
+                    False,
+                    now,
+                    1,
+                )
+                for n in range(start, min(start + batch, count))
+            ]
+            cursor.executemany(
+                "INSERT INTO task (title, description, completed, created_at, owner_id) VALUES (?, ?, ?, ?, ?)",
+                rows,
+            )
+        raw.commit()
+    finally:
+        raw.close()
+
+
+def time_query(session, stmt, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        session.exec(stmt).all()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings) * 1000
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tasks", type=int, default=1_000_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = build_engine("sqlite:///" + os.path.join(tmp, "search.db"), echo=False)
+        SQLModel.metadata.create_all(engine)
+        migrate_schema(engine)
+
+        rng = random.Random(7)
+        words = vocabulary(20000, rng)
+        start = time.perf_counter()
+        seed(engine, args.tasks, words)
+        print(f"seeded {args.tasks} tasks in {time.perf_counter() - start:.1f}s")
+
+        with Session(engine) as session:
+            terms = [rng.choice(words), f"{rng.choice(words)} {rng.choice(words)}", rng.choice(words)[:4]]
+            for term in terms:
+                fts = search_tasks(select(Task), term, "sqlite").limit(50)
+                like = (
+                    select(Task)
+                    .where(and_(*[
+                        Task.title.contains(word) | Task.description.contains(word)
+                        for word in term.split()
+                    ]))
+                    .limit(50)
+                )
+                print(
+                    f"{term!r:>28}: fts {time_query(session, fts, args.repeat):8.2f} ms"
+                    f"   like {time_query(session, like, args.repeat):8.2f} ms"
+                )
+        engine.dispose()
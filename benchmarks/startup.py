@@ -0,0 +1,98 @@
+"""Measure how long a worker takes to import the app and become ready.
+
+Each measurement runs in a fresh interpreter, the way a new worker
+starts. Run from the repo root:
+
+    python -m benchmarks.startup                 # 5 runs each
+    python -m benchmarks.startup --runs 10 --top 20
+
+Reports:
+  import      `import main`, split by package with -X importtime
+  startup     the lifespan's startup half, on an empty and on an already
+              migrated database
+  first req   the first request after startup, with the pool and the
+              OpenAPI schema already warm
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+PROBE = r"""
+import asyncio, json, os, sys, time
+started = time.perf_counter()
+import main
+imported = time.perf_counter()
+
+async def probe():
+    import httpx
+    async with main.lifespan(main.app):
+        ready = time.perf_counter()
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://startup") as client:
+            await client.get("/openapi.json")
+            await client.get("/")
+        answered = time.perf_counter()
+    return ready, answered
+
+ready, answered = asyncio.run(probe())
+print(json.dumps({
+    "import_ms": (imported - started) * 1000,
+    "startup_ms": (ready - imported) * 1000,
+    "first_request_ms": (answered - ready) * 1000,
+}))
+"""
+
+
+def run_probe(database_url: str) -> dict:
+    env = dict(os.environ, DATABASE_URL=database_url, OUTBOX_POLL_SECONDS="60")
+    output = subprocess.run([sys.executable, "-c", PROBE], env=env, check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def import_profile(top: int) -> list[tuple[str, float]]:
+    #-X importtime writes "import time: self | cumulative | module" to stderr, in microseconds.
+    #Self times summed per root package add up without counting nested imports twice
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        check=True, capture_output=True, text=True,
+    )
+    packages = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        own, _, name = line.removeprefix("import time:").split("|")
+        package = name.strip().split(".")[0]
+        packages[package] = packages.get(package, 0.0) + int(own) / 1000
+    return sorted(packages.items(), key=lambda item: item[1], reverse=True)[:top]
+
+
+def summarise(samples: list[dict], key: str) -> str:
+    values = [sample[key] for sample in samples]
+    return f"median {statistics.median(values):8.1f}ms   min {min(values):8.1f}ms   max {max(values):8.1f}ms"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure import and startup time of a worker.")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10, help="slowest packages to list")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        fresh, migrated = [], []
+        for run in range(args.runs):
+            url = "sqlite:///" + os.path.join(tmp, f"startup-{run}.db")
+            fresh.append(run_probe(url))
+            migrated.append(run_probe(url))
+
+    print(f"{'import':<28}{summarise(migrated, 'import_ms')}")
+    print(f"{'startup, empty database':<28}{summarise(fresh, 'startup_ms')}")
+    print(f"{'startup, migrated database':<28}{summarise(migrated, 'startup_ms')}")
+    print(f"{'first request':<28}{summarise(migrated, 'first_request_ms')}")
+    print()
+    print("slowest imports, by package:")
+    for name, ms in import_profile(args.top):
+        print(f"  {name:<40}{ms:8.1f}ms")
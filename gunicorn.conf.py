@@ -0,0 +1,26 @@
+#production profile: gunicorn -c gunicorn.conf.py main:app
+import multiprocessing
+import os
+
+bind = os.getenv("BIND", "0.0.0.0:8000")
+workers = int(os.getenv("WEB_CONCURRENCY", str(multiprocessing.cpu_count())))
+worker_class = "uvicorn.workers.UvicornWorker"
+graceful_timeout = int(os.getenv("GRACEFUL_TIMEOUT", "30"))
+keepalive = 5
+
+#every worker has its own bcrypt pool, split the cores between them instead of multiplying
+os.environ.setdefault("PASSWORD_HASH_WORKERS", str(max(1, multiprocessing.cpu_count() // workers)))
+#share the token, membership and response caches between workers once CACHE_SQLITE_PATH names
+#a file in a directory only the app user can write. Without one every worker keeps its own,
+#and a role or token change reaches the other workers when their entries expire
+os.environ.setdefault("CACHE_BACKEND", "sqlite" if os.getenv("CACHE_SQLITE_PATH") else "memory")
+
+
+def on_starting(server):
+    #migrate once in the master before any worker exists, then tell the workers not to
+    from app.db.session import create_db_and_tables, engine
+
+    create_db_and_tables()
+    #forked workers must not inherit the master's pooled connections
+    engine.dispose()
+    os.environ["RUN_MIGRATIONS"] = "false"
@@ -1,9 +1,40 @@
+import logging
+import time
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
-from app.db.session import create_db_and_tables
+from starlette.concurrency import run_in_threadpool
+from app.db.session import async_engine, create_db_and_tables, engine, prewarm_pool, run_migrations
+from app.utils.instrumentation import MetricsMiddleware, instrument_engine
+from app.utils.outbox import outbox_worker
+from app.utils.security import shutdown_password_hasher
 from app.api.users import router as users_router
 from app.api.orgs import router as orgs_router
 from app.api.tasks import router as tasks_router
-app = FastAPI()
+from app.api.metrics import router as metrics_router
+
+logger = logging.getLogger("app.startup")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    started = time.perf_counter()
+    if run_migrations():
+        #serialised across workers by a lock, see migration_lock
+        await run_in_threadpool(create_db_and_tables)
+    #build once here rather than on the first /docs hit in every worker
+    app.openapi()
+    await prewarm_pool()
+    outbox_worker.start()
+    app.state.startup_seconds = time.perf_counter() - started
+    logger.info("startup took %.0fms", app.state.startup_seconds * 1000)
+    yield
+    await outbox_worker.stop()
+    shutdown_password_hasher()
+    await async_engine.dispose()
+
+
+app = FastAPI(lifespan=lifespan)
 from fastapi.openapi.utils import get_openapi
 
 def custom_openapi():
@@ -33,16 +64,18 @@ app.openapi = custom_openapi
 app.include_router(users_router)
 app.include_router(orgs_router)
 app.include_router(tasks_router)
+app.include_router(metrics_router)
+
+#per route latency, SQL statement counts/time/rows and bcrypt time, served on /metrics
+instrument_engine(engine)
+instrument_engine(async_engine)
+app.add_middleware(MetricsMiddleware)
 
 @app.get("/")
 async def root():
     return {"message": "Hello World"}
 
 
-@app.on_event("startup")
-def on_startup():
-    create_db_and_tables()
-
 
 
 